@@ -0,0 +1,72 @@
+"""Initial schema, as previously created by metadata.create_all
+
+Databases created before migrations existed already have these tables;
+mark them with `alembic stamp 0001` before running `alembic upgrade head`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("first_name", sa.String(), nullable=False),
+        sa.Column("last_name", sa.String(), nullable=False),
+        sa.Column("phone", sa.String(), nullable=False),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("password", sa.String(), nullable=False),
+        sa.Column("profile_pic", sa.String(), nullable=True),
+        sa.Column("updated_by",
+                  sa.TIMESTAMP(timezone=True),
+                  server_default=sa.text("now()"),
+                  nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("email"),
+        sa.UniqueConstraint("phone"),
+    )
+    op.create_table(
+        "posts",
+        sa.Column("post_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("caption", sa.String(), nullable=False),
+        sa.Column("post_image", sa.String(), nullable=True),
+        sa.Column("is_published",
+                  sa.Boolean(),
+                  server_default="TRUE",
+                  nullable=False),
+        sa.Column("updated_by",
+                  sa.TIMESTAMP(timezone=True),
+                  server_default=sa.text("now()"),
+                  nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"],
+                                ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("post_id"),
+    )
+    op.create_table(
+        "votes",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("post_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["post_id"], ["posts.post_id"],
+                                ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"],
+                                ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "post_id"),
+    )
+
+
+def downgrade():
+    op.drop_table("votes")
+    op.drop_table("posts")
+    op.drop_table("users")
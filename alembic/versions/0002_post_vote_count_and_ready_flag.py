@@ -0,0 +1,51 @@
+"""Add posts.vote_count and posts.is_ready
+
+vote_count is backfilled from the votes table. Existing posts are marked
+ready since their images were stored before renditions existed.
+
+Both columns were added to the model before migrations existed, so a
+database created by metadata.create_all and stamped 0001 may already have
+either of them; only the missing ones are added.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {
+        column["name"]
+        for column in sa.inspect(op.get_bind()).get_columns("posts")
+    }
+
+    if "is_ready" not in columns:
+        op.add_column(
+            "posts",
+            sa.Column("is_ready",
+                      sa.Boolean(),
+                      server_default="TRUE",
+                      nullable=False))
+    if "vote_count" not in columns:
+        op.add_column(
+            "posts",
+            sa.Column("vote_count",
+                      sa.Integer(),
+                      server_default="0",
+                      nullable=False))
+    op.execute("UPDATE posts SET vote_count = ("
+               "SELECT count(*) FROM votes WHERE votes.post_id = posts.post_id)")
+
+
+def downgrade():
+    op.drop_column("posts", "vote_count")
+    op.drop_column("posts", "is_ready")
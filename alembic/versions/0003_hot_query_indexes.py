@@ -0,0 +1,48 @@
+"""Index the columns used by the hot queries
+
+- posts (updated_by, post_id): keyset pagination of the feed, also serves
+  filters and sorts on updated_by alone
+- posts.user_id: posts of a user, and the cascade when deleting a user
+- votes.post_id: votes of a post; the primary key is (user_id, post_id) so
+  it can't be used for post_id alone
+
+The indexes are built CONCURRENTLY, so they don't lock the tables for
+writes while they build.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_posts_updated_by_post_id", "posts", ["updated_by", "post_id"]),
+    ("ix_posts_user_id", "posts", ["user_id"]),
+    ("ix_votes_post_id", "votes", ["post_id"]),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name,
+                            table,
+                            columns,
+                            postgresql_concurrently=True,
+                            if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name,
+                          table_name=table,
+                          postgresql_concurrently=True,
+                          if_exists=True)
@@ -0,0 +1,55 @@
+"""Add posts.created_at and posts.hot_score for the ranked feed
+
+created_at is backfilled from updated_by, the closest thing to a creation
+time that existing rows have. hot_score is backfilled with the formula of
+app.ranking.hot_score.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "posts",
+        sa.Column("created_at",
+                  sa.TIMESTAMP(timezone=True),
+                  server_default=sa.text("now()"),
+                  nullable=False))
+    op.add_column(
+        "posts",
+        sa.Column("hot_score",
+                  sa.Float(),
+                  server_default="0",
+                  nullable=False))
+    op.execute("UPDATE posts SET created_at = updated_by")
+    op.execute("UPDATE posts SET hot_score = "
+               "log(greatest(vote_count, 1)) + "
+               "extract(epoch from created_at) / 45000")
+
+    with op.get_context().autocommit_block():
+        op.create_index("ix_posts_hot_score_post_id",
+                        "posts", ["hot_score", "post_id"],
+                        postgresql_concurrently=True,
+                        if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_posts_hot_score_post_id",
+                      table_name="posts",
+                      postgresql_concurrently=True,
+                      if_exists=True)
+
+    op.drop_column("posts", "hot_score")
+    op.drop_column("posts", "created_at")
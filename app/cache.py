@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Every cache by name, reported by /monitoring/cache_stats
+caches = {}
+
+
+# Bounded in-process cache: least recently used entries are evicted once
+# maxsize entries (or, if given, maxbytes of values) is reached, and entries
+# expire ttl seconds after being set.
+# Each worker process has its own copy, so ttl bounds how stale an entry
+# can be when another worker changes the underlying data.
+class TTLCache:
+
+    def __init__(self, name: str, maxsize: int, ttl: float,
+                 maxbytes: int = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        caches[name] = self
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    self._pop(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # nbytes is the size of value, counted against maxbytes
+    def set(self, key, value, ttl: float = None, nbytes: int = 0):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, expires_at, nbytes)
+            self.nbytes += nbytes
+
+            while len(self._entries) > self.maxsize or (
+                    self.maxbytes is not None
+                    and self.nbytes > self.maxbytes):
+                self._pop(next(iter(self._entries)))
+
+    def invalidate(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        return dict(size=len(self._entries),
+                    maxsize=self.maxsize,
+                    nbytes=self.nbytes,
+                    hits=self.hits,
+                    misses=self.misses)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
@@ -0,0 +1,228 @@
+import argparse
+import csv
+import io
+import shutil
+import sys
+import tempfile
+import psycopg2
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from . import models, ranking, utils
+from .databases import SessionLocal, engine
+
+# Tables handled by import/export, in dependency order, with the column
+# their rows are ordered by and, if any, the serial column behind their ids
+COPY_TABLES = {
+    models.Users.__tablename__: ("id", "id"),
+    models.Post.__tablename__: ("post_id", "post_id"),
+    models.Votes.__tablename__: ("user_id, post_id", None),
+}
+
+COPY_BATCH_ROWS = 100000
+
+
+# Recompute posts.vote_count from the votes table, and the hot score that
+# depends on it, only touching rows that drifted. Returns the number of
+# posts repaired.
+def reconcile_vote_counts(db: Session) -> int:
+    actual_votes = (select(func.count(models.Votes.post_id)).where(
+        models.Votes.post_id == models.Post.post_id).scalar_subquery())
+
+    repaired = db.query(models.Post).filter(
+        models.Post.vote_count != actual_votes).update(
+            {
+                models.Post.vote_count:
+                actual_votes,
+                models.Post.hot_score:
+                ranking.hot_score(actual_votes, models.Post.created_at)
+            },
+            synchronize_session=False)
+
+    db.commit()
+
+    return repaired
+
+
+# Stream rows into table with COPY, in batches so memory use stays flat.
+# None is written as NULL. Returns the number of rows.
+def copy_rows(cursor, table, columns, rows) -> int:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+
+    def flush():
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN "
+            "WITH (FORMAT csv)", buffer)
+        buffer.seek(0)
+        buffer.truncate()
+
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % COPY_BATCH_ROWS == 0:
+            flush()
+
+    if buffer.tell():
+        flush()
+
+    return count
+
+
+# Move the id sequences past the largest id, needed after rows were loaded
+# with explicit ids
+def fix_sequences(cursor):
+    for table, (_, serial_column) in COPY_TABLES.items():
+        if serial_column is not None:
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', "
+                f"'{serial_column}'), coalesce(max({serial_column}), 0) + 1, "
+                f"false) FROM {table}")
+
+
+def table_columns(table: str):
+    return [column.name for column in models.Base.metadata.tables[table].c]
+
+
+# Write every row of table to output_file as CSV with a header line
+def export_table(connection, table: str, output_file):
+    order_by, _ = COPY_TABLES[table]
+    columns = ", ".join(table_columns(table))
+    cursor = connection.cursor()
+    cursor.copy_expert(
+        f"COPY (SELECT {columns} FROM {table} ORDER BY {order_by}) "
+        "TO STDOUT WITH (FORMAT csv, HEADER)", output_file)
+
+
+# Load a CSV file with a header line into table. Columns missing from the
+# file get their defaults. Passwords must already be hashed: plain text
+# passwords are rejected rather than stored, and hashes made with another
+# bcrypt cost are upgraded on the user's next login. The file is streamed
+# to COPY unchanged, so empty strings and NULLs survive an export/import
+# round trip, and loaded in one transaction. input_file must be seekable.
+# Returns the number of rows.
+def import_table(connection, table: str, input_file) -> int:
+    reader = csv.reader(input_file)
+    header = next(reader, None)
+    if not header:
+        raise ValueError("The file is empty, a header line is required.")
+
+    unknown_columns = set(header) - set(table_columns(table))
+    if unknown_columns:
+        raise ValueError(f"Unknown columns for {table}: "
+                         f"{', '.join(sorted(unknown_columns))}")
+
+    # Read-only pass over the passwords before anything is written
+    if table == models.Users.__tablename__ and "password" in header:
+        password_index = header.index("password")
+        for row in reader:
+            if not utils.pwd_context.identify(row[password_index],
+                                              required=False):
+                raise ValueError(f"Line {reader.line_num}: password is not "
+                                 "a bcrypt hash.")
+
+    input_file.seek(0)
+
+    cursor = connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(header)}) FROM STDIN "
+            "WITH (FORMAT csv, HEADER)", input_file)
+        count = cursor.rowcount
+        fix_sequences(cursor)
+
+        # Scores aren't part of exports of older versions; same formula as
+        # ranking.hot_score
+        if (table == models.Post.__tablename__
+                and "hot_score" not in header):
+            cursor.execute("UPDATE posts SET hot_score = log(greatest("
+                           "vote_count, 1)) + extract(epoch FROM created_at) "
+                           f"/ {ranking.HOT_DECAY_SECONDS} "
+                           "WHERE hot_score = 0")
+
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+    cursor.execute(f"ANALYZE {table}")
+    connection.commit()
+
+    return count
+
+
+def export_command(args):
+    connection = engine.raw_connection()
+    try:
+        if args.path == "-":
+            export_table(connection, args.table, sys.stdout)
+        else:
+            with open(args.path, "w", newline="") as output_file:
+                export_table(connection, args.table, output_file)
+    finally:
+        connection.close()
+
+
+def import_command(args):
+    connection = engine.raw_connection()
+    try:
+        if args.path == "-":
+            # The file is read twice, so stdin is spooled to disk first
+            with tempfile.TemporaryFile("w+", newline="") as input_file:
+                shutil.copyfileobj(sys.stdin, input_file)
+                input_file.seek(0)
+                count = import_table(connection, args.table, input_file)
+        else:
+            with open(args.path, newline="") as input_file:
+                count = import_table(connection, args.table, input_file)
+        print(f"Imported {count} row(s) into {args.table}.")
+    except (ValueError, psycopg2.Error) as e:
+        raise SystemExit(f"Import failed: {e}")
+    finally:
+        connection.close()
+
+    # Vote counts are denormalized on posts
+    if args.table == models.Votes.__tablename__:
+        reconcile_votes_command(args)
+
+
+def reconcile_votes_command(args):
+    db = SessionLocal()
+    try:
+        repaired = reconcile_vote_counts(db)
+        print(f"Reconciled vote counts, {repaired} post(s) repaired.")
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli",
+                                     description="Social App maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    reconcile_parser = subparsers.add_parser(
+        "reconcile-votes",
+        help="Recompute posts.vote_count and hot_score from votes")
+    reconcile_parser.set_defaults(func=reconcile_votes_command)
+
+    export_parser = subparsers.add_parser(
+        "export", help="Write a table to a CSV file with PostgreSQL COPY")
+    export_parser.add_argument("table", choices=list(COPY_TABLES))
+    export_parser.add_argument("path", help="CSV file, - for stdout")
+    export_parser.set_defaults(func=export_command)
+
+    import_parser = subparsers.add_parser(
+        "import",
+        help="Load a CSV file with a header line into a table with "
+        "PostgreSQL COPY, passwords must be bcrypt hashes")
+    import_parser.add_argument("table", choices=list(COPY_TABLES))
+    import_parser.add_argument("path", help="CSV file, - for stdin")
+    import_parser.set_defaults(func=import_command)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,50 @@ class Settings(BaseSettings):
     database_username: str
     secret_key: str
     algorithm: str
-    # access_token_expire_minutes: int
+    access_token_expire_minutes: int = 60
     # refresh_token_expire_minutes: int
+    # Run metadata.create_all on startup, for local development only;
+    # deployments manage the schema with alembic
+    create_schema_on_startup: bool = False
+    # Connection pool, per engine and per worker process
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30
+    db_pool_pre_ping: bool = True
+    db_pool_recycle: int = 1800
+    # Prefix for image URLs in responses, e.g. a CDN in front of the app
+    media_base_url: str = ""
+    static_cache_max_age: int = 31536000
+    max_upload_size: int = 10 * 1024 * 1024
+    # Authenticated user lookups, cached per worker process
+    user_cache_size: int = 10000
+    user_cache_ttl: int = 60
+    # Verified access tokens, each cached until it expires
+    token_cache_size: int = 10000
+    # Base64 encoded images served to clients asking for inline images
+    image_cache_size: int = 1000
+    image_cache_ttl: int = 3600
+    image_cache_max_bytes: int = 64 * 1024 * 1024
+    # bcrypt cost factor, and threads doing password hashing per worker
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 4
+    # Image processing pool, output format is JPEG or WEBP
+    image_workers: int = 2
+    image_format: str = "JPEG"
+    # Buffer votes in memory and write them in batches, see vote_buffer.py
+    # for what can be lost on a crash
+    vote_write_behind: bool = False
+    vote_flush_interval: float = 1.0
+    vote_flush_size: int = 1000
+    # Statements slower than this are logged by the app.slow_queries logger
+    slow_query_threshold_ms: float = 500
+    # Request profiling, see profiling.py. Off unless enabled, and only
+    # callers sending the token can ask for a report
+    profiling_enabled: bool = False
+    profiling_token: str = ""
+    profiling_sample_rate: float = 0.0
+    profiling_directory: str = "profiles"
+    profiling_report_lines: int = 50
 
     class Config:
         env_file = ".env"
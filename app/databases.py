@@ -1,21 +1,91 @@
+import time
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
 
 SQLALCHEMY_DB_URL = f"postgresql://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"  # 'postgressql://<username>:<password>@<ipaddress/hostname>/<dbname>'
+SQLALCHEMY_ASYNC_DB_URL = SQLALCHEMY_DB_URL.replace("postgresql://",
+                                                    "postgresql+asyncpg://", 1)
 
-engine = create_engine(SQLALCHEMY_DB_URL)
+pool_options = dict(pool_size=settings.db_pool_size,
+                    max_overflow=settings.db_max_overflow,
+                    pool_timeout=settings.db_pool_timeout,
+                    pool_pre_ping=settings.db_pool_pre_ping,
+                    pool_recycle=settings.db_pool_recycle)
+
+# Synchronous engine, used for schema creation and maintenance commands
+engine = create_engine(SQLALCHEMY_DB_URL, **pool_options)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+# Time spent waiting for a pooled connection of the async engine
+class PoolWaitStats:
+
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float):
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+pool_wait_stats = PoolWaitStats()
+
+
+# Times every checkout, including the wait for a free connection and
+# opening a new one. Sessions only check out a connection when they first
+# run a statement, so requests rejected before that (e.g. a 401) don't
+# touch the pool at all.
+class TimedQueuePool(AsyncAdaptedQueuePool):
+
+    def connect(self):
+        start = time.perf_counter()
+        connection = super().connect()
+        pool_wait_stats.record(time.perf_counter() - start)
+        return connection
+
+
+# Async engine used by the API so queries don't block the event loop.
+# expire_on_commit is off because expired attributes can't be lazy loaded
+# from async code; refresh explicitly where server-side values are needed.
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DB_URL,
+                                   poolclass=TimedQueuePool,
+                                   **pool_options)
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine,
+                                       autoflush=False,
+                                       expire_on_commit=False)
+
 Base = declarative_base()
 
 
+def get_pool_stats() -> dict:
+    pool = async_engine.sync_engine.pool
+    checkouts = pool_wait_stats.checkouts
+    return dict(pool_size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=max(pool.overflow(), 0),
+                max_overflow=settings.db_max_overflow,
+                checkouts=checkouts,
+                avg_wait_ms=(pool_wait_stats.total_wait / checkouts *
+                             1000 if checkouts else 0.0),
+                max_wait_ms=pool_wait_stats.max_wait * 1000)
+
+
 # Dependencies
-def get_db():
-    db = SessionLocal()
+# The session is always closed (returning its connection, if it took one,
+# to the pool) when the request finishes, whether it succeeded or not.
+async def get_db():
+    db = AsyncSessionLocal()
     try:
         yield db
     finally:
-        db.close
+        await db.close()
@@ -0,0 +1,147 @@
+import asyncio
+import importlib.util
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+from .config import settings
+
+# Longest side, in pixels, of each stored rendition
+RENDITIONS = {"thumbnail": 200, "feed": 1080, "full": 2048}
+
+FORMAT_EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp"}
+
+# ISO BMFF brands of HEIF/HEIC files
+HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1",
+               b"msf1"}
+
+_executor = None
+
+
+# Decoding and resizing is CPU bound, so it runs in worker processes rather
+# than threads. Workers are spawned, not forked, as the app process has
+# running threads and an event loop.
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.image_workers,
+            mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+# HEIC uploads are decoded by pillow-heif (in requirements.txt). Installs
+# without it reject them up front instead of failing in the pool; checked
+# without importing it.
+def heic_supported() -> bool:
+    return importlib.util.find_spec("pillow_heif") is not None
+
+
+def allowed_extensions() -> List[str]:
+    extensions = ["jpeg", "jpg", "png"]
+    if heic_supported():
+        extensions.append("heic")
+    return extensions
+
+
+# Format of an uploaded file from its leading bytes (jpeg, png or heic), or
+# None when it isn't one of them. Cheap enough to run before accepting an
+# upload, unlike decoding it.
+def sniff_image_format(path: str) -> Optional[str]:
+    with open(path, "rb") as image_file:
+        header = image_file.read(12)
+
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header[4:8] == b"ftyp" and header[8:12] in HEIF_BRANDS:
+        return "heic"
+    return None
+
+
+def rendition_path(output_base: str, name: str, image_format: str) -> str:
+    return f"{output_base}_{name}.{FORMAT_EXTENSIONS[image_format]}"
+
+
+# All renditions of a stored image, given the path of its full rendition.
+# Images stored before renditions existed only have themselves.
+def rendition_paths(image_path: str) -> Dict[str, str]:
+    base, extension = os.path.splitext(image_path)
+    if not base.endswith("_full"):
+        return {"full": image_path}
+
+    base = base[:-len("_full")]
+    return {name: f"{base}_{name}{extension}" for name in RENDITIONS}
+
+
+# Pillow is only needed by the worker processes, so it isn't imported with
+# the app
+def _load_pillow():
+    from PIL import Image, ImageOps
+
+    try:
+        from pillow_heif import register_heif_opener
+    except ImportError:  # not installed, HEIC uploads are rejected
+        pass
+    else:
+        register_heif_opener()
+
+    return Image, ImageOps
+
+
+# Runs in a worker process: decode the upload (any format Pillow can read),
+# fix the EXIF orientation, and write every rendition next to output_base.
+# The source upload is removed afterwards.
+def process_image(source_path: str, output_base: str,
+                  image_format: str) -> Dict[str, str]:
+    Image, ImageOps = _load_pillow()
+
+    paths = {}
+    with Image.open(source_path) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+
+        for name, size in RENDITIONS.items():
+            rendition = img.copy()
+            rendition.thumbnail((size, size))
+
+            path = rendition_path(output_base, name, image_format)
+            temp_path = f"{path}.part"
+            rendition.save(temp_path, image_format, quality=85)
+            os.replace(temp_path, path)
+            paths[name] = path
+
+    os.remove(source_path)
+
+    return paths
+
+
+async def process_image_async(source_path: str,
+                              output_base: str) -> Dict[str, str]:
+    global _executor
+    loop = asyncio.get_running_loop()
+    image_format = settings.image_format.upper()
+    executor = get_executor()
+    try:
+        return await loop.run_in_executor(executor, process_image,
+                                          source_path, output_base,
+                                          image_format)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory), which breaks the pool for
+        # good; start a new one and retry once. Every task that was in the
+        # broken pool gets here, only the first replaces it.
+        if _executor is executor:
+            _executor = None
+            executor.shutdown(wait=False)
+        return await loop.run_in_executor(get_executor(), process_image,
+                                          source_path, output_base,
+                                          image_format)
+
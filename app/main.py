@@ -1,36 +1,108 @@
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Security
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import APIKeyHeader
-from . import schemas, models, databases
-from .routers import auth, posts, votes
+from . import (schemas, models, databases, images, utils, vote_buffer,
+               metrics, profiling, upload_limit)
+from .config import settings
+from .static import CachedStaticFiles
+from .routers import auth, posts, votes, monitoring
 
-models.Base.metadata.create_all(bind=databases.engine)
+origins = ["*"]
 
-app = FastAPI(title="Social App",
-              version="0.0.1",
-              description="A sample social app",
-              docs_url="/docs/",
-              redoc_url="/redoc/")
 
-origins = ["*"]
+# Startup and shutdown work, run once per worker process. Nothing here
+# happens at import time, so importing the app is cheap and doesn't need
+# a database.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for directory in (posts.post_images_directory,
+                      auth.profile_pictures_directory):
+        os.makedirs(directory, exist_ok=True)
+
+    if settings.create_schema_on_startup:
+        async with databases.async_engine.begin() as connection:
+            await connection.run_sync(models.Base.metadata.create_all)
+
+    vote_buffer.start_vote_buffer()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    yield
+
+    await vote_buffer.stop_vote_buffer()
+    images.shutdown_executor()
+    utils.shutdown_password_executor()
+    await databases.async_engine.dispose()
 
 
 # initial root
-@app.get("/", name="root", tags=["root"])
 def root():
     message = "Welcome to social app"
     response_model = schemas.CommonMessageResponse(message=message)
     return response_model
 
 
-app.include_router(auth.router)
-app.include_router(posts.router)
-app.include_router(votes.router)
+def create_app() -> FastAPI:
+    app = FastAPI(title="Social App",
+                  version="0.0.1",
+                  description="A sample social app",
+                  docs_url="/docs/",
+                  redoc_url="/redoc/",
+                  lifespan=lifespan,
+                  default_response_class=ORJSONResponse)
+
+    # Oversized uploads are refused before the multipart form is spooled
+    app.add_middleware(upload_limit.UploadLimitMiddleware,
+                       paths=("/post/create_post", "/auth/upload_profile_pic/"))
+
+    app.add_middleware(profiling.ProfilingMiddleware)
+
+    # Middlewares added later wrap the earlier ones. CORS goes outside the
+    # upload limit and profiling so their own responses (the 413, the
+    # profile report) carry CORS headers and browsers can read them.
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Added last so it wraps everything else and times the whole request
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    app.add_api_route("/",
+                      root,
+                      name="root",
+                      tags=["root"],
+                      methods=["GET"],
+                      response_model=schemas.CommonMessageResponse)
+
+    # Scraped by Prometheus, so it's left out of the API docs
+    app.add_api_route("/metrics",
+                      metrics.get_metrics,
+                      name="metrics",
+                      methods=["GET"],
+                      include_in_schema=False)
+
+    # Stored image paths are relative to these mounts (see schemas.image_url).
+    # The directories are created by lifespan, so they aren't checked here.
+    app.mount("/posts_images",
+              CachedStaticFiles(directory=posts.post_images_directory,
+                                check_dir=False),
+              name="posts_images")
+    app.mount("/profile_pictures",
+              CachedStaticFiles(directory=auth.profile_pictures_directory,
+                                check_dir=False),
+              name="profile_pictures")
+
+    app.include_router(auth.router)
+    app.include_router(posts.router)
+    app.include_router(votes.router)
+    app.include_router(monitoring.router)
+
+    return app
+
+
+app = create_app()
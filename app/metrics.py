@@ -0,0 +1,169 @@
+import time
+from collections import defaultdict
+from fastapi.responses import PlainTextResponse
+from . import query_counter
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+# SQL executed while serving one request, fed by query_counter
+class RequestStats:
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+
+    def record(self, statement: str, elapsed: float, rows: int):
+        self.statements += 1
+        self.db_time += elapsed
+        self.rows += rows
+
+
+# Totals for one (method, route) pair since the worker started
+class RouteMetrics:
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.responses = defaultdict(int)
+
+    def observe(self, duration: float, status_code: int,
+                stats: RequestStats):
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                self.bucket_counts[index] += 1
+                break
+        self.count += 1
+        self.duration += duration
+        self.statements += stats.statements
+        self.db_time += stats.db_time
+        self.rows += stats.rows
+        self.responses[status_code] += 1
+
+
+# Metrics of this worker process by (method, route template)
+route_metrics = defaultdict(RouteMetrics)
+
+
+# Records every HTTP request under its route template (e.g.
+# /post/get_post/{post_id}) so the number of series stays bounded. The
+# latency is measured until the last byte of the response is sent, so
+# background tasks running afterwards aren't counted against the request.
+class MetricsMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        start = time.perf_counter()
+        status_code = 500
+        recorded = False
+
+        def record():
+            nonlocal recorded
+            if not recorded:
+                recorded = True
+                route_metrics[(scope["method"], route_label(scope))].observe(
+                    time.perf_counter() - start, status_code, stats)
+
+        async def send_and_record(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get(
+                    "more_body", False):
+                record()
+
+        try:
+            with query_counter.observe_queries(stats):
+                await self.app(scope, receive, send_and_record)
+        finally:
+            record()
+
+
+# The matched route is only known once routing has happened, FastAPI
+# leaves it in the scope
+def route_label(scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path_format
+    # Static file mounts set root_path to their mount path
+    return scope.get("root_path") or "unmatched"
+
+
+def _labels(**labels) -> str:
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+# Prometheus text exposition format, version 0.0.4
+def render_metrics() -> str:
+    routes = sorted(route_metrics.items())
+
+    lines = [
+        "# HELP http_request_duration_seconds Request latency by route.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (method, route), metrics in routes:
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS,
+                                       metrics.bucket_counts):
+            cumulative += bucket_count
+            labels = _labels(method=method, route=route, le=bound)
+            lines.append(
+                f"http_request_duration_seconds_bucket{labels} {cumulative}")
+        labels = _labels(method=method, route=route, le="+Inf")
+        lines.append(
+            f"http_request_duration_seconds_bucket{labels} {metrics.count}")
+        labels = _labels(method=method, route=route)
+        lines.append(
+            f"http_request_duration_seconds_sum{labels} {metrics.duration}")
+        lines.append(
+            f"http_request_duration_seconds_count{labels} {metrics.count}")
+
+    lines += [
+        "# HELP http_responses_total Responses by route and status code.",
+        "# TYPE http_responses_total counter",
+    ]
+    for (method, route), metrics in routes:
+        for status_code, count in sorted(metrics.responses.items()):
+            labels = _labels(method=method, route=route, status=status_code)
+            lines.append(f"http_responses_total{labels} {count}")
+
+    counters = (
+        ("sql_statements_total", "statements",
+         "SQL statements executed by route."),
+        ("sql_duration_seconds_total", "db_time",
+         "Time spent in SQL by route."),
+        ("sql_rows_total", "rows", "Rows returned or changed by SQL by route."),
+    )
+    for name, attribute, description in counters:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} counter")
+        for (method, route), metrics in routes:
+            labels = _labels(method=method, route=route)
+            lines.append(f"{name}{labels} {getattr(metrics, attribute)}")
+
+    return "\n".join(lines) + "\n"
+
+
+# Metrics of the worker process serving the scrape
+def get_metrics():
+    return PlainTextResponse(render_metrics(),
+                             media_type="text/plain; version=0.0.4")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text, Index, Float
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.sqltypes import TIMESTAMP
@@ -32,15 +32,36 @@ class Post(Base):
     post_id = Column(Integer, primary_key=True, nullable=False)
     user_id = Column(Integer,
                      ForeignKey("users.id", ondelete="CASCADE"),
-                     nullable=False)
+                     nullable=False,
+                     index=True)
     caption = Column(String, nullable=False, default=None)
     post_image = Column(String, default=None)
     is_published = Column(Boolean, server_default="TRUE", nullable=False)
+    # False until the image renditions have been generated
+    is_ready = Column(Boolean, server_default="TRUE", nullable=False)
+    # Maintained by votes_service (votes, batch votes, the vote buffer and
+    # user deletion), repaired with `python -m app.cli reconcile-votes`
+    vote_count = Column(Integer, server_default="0", default=0, nullable=False)
+    # Ranked feed score, see ranking.hot_score
+    hot_score = Column(Float, server_default="0", nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True),
+                        nullable=False,
+                        server_default=text("now()"))
     updated_by = Column(TIMESTAMP(timezone=True),
                         nullable=False,
                         server_default=text("now()"))
 
-    user_detail = relationship("Users")
+    # Never lazy loaded: queries returning posts with their author load it
+    # eagerly (see posts.select_posts), anything else fails loudly instead
+    # of issuing one query per post
+    user_detail = relationship("Users", lazy="raise_on_sql")
+
+    # Back the keyset pagination of the feeds (ORDER BY updated_by, post_id
+    # and ORDER BY hot_score, post_id)
+    __table_args__ = (Index("ix_posts_updated_by_post_id", "updated_by",
+                            "post_id"),
+                      Index("ix_posts_hot_score_post_id", "hot_score",
+                            "post_id"))
 
 
 class Votes(Base):
@@ -49,8 +70,10 @@ class Votes(Base):
     user_id = Column(Integer,
                      ForeignKey("users.id", ondelete="CASCADE"),
                      primary_key=True)
+    # Second in the primary key, so it needs its own index
     post_id = Column(Integer,
                      ForeignKey("posts.post_id", ondelete="CASCADE"),
-                     primary_key=True)
+                     primary_key=True,
+                     index=True)
 
-    post_detail = relationship("Post")
+    post_detail = relationship("Post", lazy="raise_on_sql")
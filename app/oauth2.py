@@ -2,24 +2,40 @@ from fastapi import Depends, status, HTTPException
 from fastapi.security.oauth2 import OAuth2PasswordBearer
 from jose import JWTError, jwt  # For JWT Bearer token
 from datetime import datetime, timedelta
+import hashlib
+import time
 from . import schemas, databases, models
-from sqlalchemy.orm import Session
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from .cache import TTLCache
 from .config import settings
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 SECRET_KEY = settings.secret_key
 ALGORITHM = settings.algorithm
-#ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
+ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
+
+# Column values of authenticated users by id
+user_cache = TTLCache("users",
+                      maxsize=settings.user_cache_size,
+                      ttl=settings.user_cache_ttl)
+
+# TokenData of already verified tokens by token hash, each entry expiring
+# with its token
+token_cache = TTLCache("tokens",
+                       maxsize=settings.token_cache_size,
+                       ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
 
 
 def create_access_token(data: dict):
     to_encode = data.copy()
 
-    # expire = datetime.utcnow() + timedelta(
-    #     minutes=ACCESS_TOKEN_EXPIRE_MINUTES
-    # )  # always expiration time is in utc
-    # to_encode.update({"exp": expire})
+    expire = datetime.utcnow() + timedelta(
+        minutes=ACCESS_TOKEN_EXPIRE_MINUTES
+    )  # always expiration time is in utc
+    to_encode.update({"exp": expire})
 
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
@@ -27,8 +43,20 @@ def create_access_token(data: dict):
 
 
 def verify_access_token(token: str, credentials_exceptions):
+    # Repeat requests with the same token skip the signature check
+    token_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    token_data = token_cache.get(token_key)
+
+    if token_data is not None:
+        return token_data
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Tokens issued before expiry was introduced have no exp and are
+        # rejected, so they can't stay valid forever
+        payload = jwt.decode(token,
+                             SECRET_KEY,
+                             algorithms=[ALGORITHM],
+                             options={"require_exp": True})
 
         user_id: str = payload.get("user_id")
 
@@ -40,11 +68,13 @@ def verify_access_token(token: str, credentials_exceptions):
     except JWTError:
         raise credentials_exceptions
 
+    token_cache.set(token_key, token_data, ttl=payload["exp"] - time.time())
+
     return token_data
 
 
-def get_current_user(token: str = Depends(oauth2_scheme),
-                     db: Session = Depends(databases.get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme),
+                           db: AsyncSession = Depends(databases.get_db)):
     credentials_exceptions = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail=f"Could not validate credentials",
@@ -53,7 +83,28 @@ def get_current_user(token: str = Depends(oauth2_scheme),
 
     token = verify_access_token(token, credentials_exceptions)
 
-    user_data = db.query(
-        models.Users).filter(models.Users.id == token.id).first()
+    user_values = user_cache.get(token.id)
+
+    if user_values is None:
+        user_data = await db.get(models.Users, token.id)
+
+        if user_data is not None:
+            user_cache.set(
+                token.id, {
+                    attr.key: getattr(user_data, attr.key)
+                    for attr in inspect(models.Users).column_attrs
+                })
+
+        return user_data
+
+    # Attach the cached row to this session without a query, so handlers
+    # looking the user up again by id hit the identity map
+    user_data = models.Users(**user_values)
+    make_transient_to_detached(user_data)
+
+    return await db.merge(user_data, load=False)
+
 
-    return user_data
+# Must be called whenever a user row is changed or deleted
+def invalidate_cached_user(user_id: int):
+    user_cache.invalidate(user_id)
@@ -0,0 +1,124 @@
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from starlette.concurrency import run_in_threadpool
+from .config import settings
+from .metrics import route_label
+
+PROFILE_TOKEN_HEADER = b"x-profile-token"
+
+# cProfile hooks the whole event loop thread, so only one request is
+# profiled at a time
+_profiling = False
+
+
+# Profiles single requests with cProfile when PROFILING_ENABLED is set:
+# - a request carrying the X-Profile-Token header with the configured
+#   PROFILING_TOKEN gets the report back instead of its response (the
+#   original status is kept in X-Profiled-Status)
+# - a PROFILING_SAMPLE_RATE fraction of all other requests is profiled
+#   silently
+# Both store the raw stats under PROFILING_DIRECTORY, to open with pstats
+# or snakeviz. Other requests served concurrently on the same worker show
+# up in the profile too, and sync endpoints run in the threadpool are not
+# seen at all.
+class ProfilingMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _profiling
+
+        if (scope["type"] != "http" or not settings.profiling_enabled
+                or _profiling):
+            await self.app(scope, receive, send)
+            return
+
+        requested = is_profile_requested(scope)
+        sampled = random.random() < settings.profiling_sample_rate
+        if not (requested or sampled):
+            await self.app(scope, receive, send)
+            return
+
+        messages = []
+
+        async def buffer_response(message):
+            messages.append(message)
+
+        _profiling = True
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                await self.app(scope, receive,
+                               buffer_response if requested else send)
+            finally:
+                profiler.disable()
+        finally:
+            _profiling = False
+
+        duration = time.perf_counter() - start
+        file_name = await run_in_threadpool(store_profile, profiler, scope)
+
+        if requested:
+            status_code = next((message["status"] for message in messages
+                                if message["type"] == "http.response.start"),
+                               500)
+            await send_report(send, profiler, file_name, status_code,
+                              duration)
+
+
+# Only callers knowing the token can profile, an empty token disables it
+def is_profile_requested(scope) -> bool:
+    if not settings.profiling_token:
+        return False
+
+    for name, value in scope["headers"]:
+        if name == PROFILE_TOKEN_HEADER:
+            return hmac.compare_digest(value,
+                                       settings.profiling_token.encode())
+    return False
+
+
+# Dump the raw stats, returns the file name
+def store_profile(profiler: cProfile.Profile, scope) -> str:
+    os.makedirs(settings.profiling_directory, exist_ok=True)
+
+    route = re.sub(r"[^A-Za-z0-9]+", "_", route_label(scope)).strip("_")
+    file_name = (f"{time.strftime('%Y%m%dT%H%M%S')}_{scope['method']}_"
+                 f"{route or 'root'}_{uuid.uuid4().hex[:8]}.prof")
+    profiler.dump_stats(os.path.join(settings.profiling_directory, file_name))
+
+    return file_name
+
+
+async def send_report(send, profiler: cProfile.Profile, file_name: str,
+                      status_code: int, duration: float):
+    stream = io.StringIO()
+    stream.write(f"Request took {duration * 1000:.1f} ms, status "
+                 f"{status_code}, stored as {file_name}\n\n")
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats("cumulative").print_stats(settings.profiling_report_lines)
+    body = stream.getvalue().encode("utf-8")
+
+    report_name = os.path.splitext(file_name)[0] + ".txt"
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", str(len(body)).encode()),
+            (b"content-disposition",
+             f'attachment; filename="{report_name}"'.encode()),
+            (b"x-profiled-status", str(status_code).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,97 @@
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+from . import databases
+from .config import settings
+
+slow_query_logger = logging.getLogger("app.slow_queries")
+
+# Observers of the code currently running, innermost last: the metrics of
+# the request being served and any count_queries blocks inside it. Context
+# variables follow the request task into SQLAlchemy's async greenlets, so
+# concurrent requests don't see each other's statements.
+_observers = contextvars.ContextVar("query_observers", default=())
+
+
+# Statements executed inside a count_queries block
+class QueryCounter:
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def record(self, statement: str, elapsed: float, rows: int):
+        self.statements.append(statement)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    # Rows returned by a SELECT or changed by an INSERT/UPDATE/DELETE
+    rows = max(cursor.rowcount, 0)
+
+    for observer in _observers.get():
+        observer.record(statement, elapsed, rows)
+
+    if elapsed * 1000 >= settings.slow_query_threshold_ms:
+        # Statement only, parameters can hold passwords and personal data
+        slow_query_logger.warning("Slow query (%.1f ms): %s", elapsed * 1000,
+                                  statement)
+
+
+# A failed statement never reaches after_cursor_execute
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        conn.info["query_start_time"].pop()
+
+
+# The only cursor hooks of the app, shared by metrics and count_queries
+for _engine in (databases.engine, databases.async_engine.sync_engine):
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(_engine, "handle_error", _handle_error)
+
+
+# Pass every statement executed inside the block to observer.record(
+# statement, elapsed, rows), together with any observers already active
+@contextmanager
+def observe_queries(observer):
+    token = _observers.set(_observers.get() + (observer, ))
+    try:
+        yield observer
+    finally:
+        _observers.reset(token)
+
+
+# Collect the SQL statements executed inside the block
+@contextmanager
+def count_queries():
+    with observe_queries(QueryCounter()) as counter:
+        yield counter
+
+
+# Fail with the executed statements when the block runs more than limit of
+# them, e.g. around a request made with httpx.AsyncClient(app=app) so an
+# N+1 regression in an endpoint fails CI. The request has to run in the
+# caller's context, so starlette's TestClient (which uses another thread)
+# doesn't work here.
+@contextmanager
+def assert_max_queries(limit: int):
+    with count_queries() as counter:
+        yield counter
+
+    if counter.count > limit:
+        statements = "\n".join(counter.statements)
+        raise AssertionError(f"{counter.count} SQL statements executed, "
+                             f"expected at most {limit}:\n{statements}")
@@ -0,0 +1,14 @@
+from sqlalchemy import func
+
+# A post needs 10x the votes to rank as high as one posted this many
+# seconds later (12.5 hours)
+HOT_DECAY_SECONDS = 45000
+
+
+# SQL expression of the hot rank of a post. It only depends on the vote
+# count and the creation time, so a post's score never has to be refreshed
+# as time passes: newer posts simply start higher. It is recomputed when a
+# vote changes vote_count.
+def hot_score(vote_count, created_at):
+    return (func.log(func.greatest(vote_count, 1)) +
+            func.extract("epoch", created_at) / HOT_DECAY_SECONDS)
@@ -1,36 +1,32 @@
-import base64
-import io
-from fastapi import HTTPException, APIRouter, status, Depends, Query, Body, UploadFile, File, Request
+from fastapi import HTTPException, APIRouter, status, Depends, Query, Body, UploadFile, File, Request, Response
 from fastapi.responses import FileResponse, StreamingResponse
-from sqlalchemy.orm import Session, load_only
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
-from fastapi.staticfiles import StaticFiles
-from PIL import Image
 from io import BytesIO
-from sqlalchemy import asc
+from sqlalchemy import asc, func, select, delete
 import os
+import uuid
 from pathlib import Path
+from typing import Optional
+from ..config import settings
 from ..databases import get_db
-from .. import models, schemas, utils, oauth2, databases
+from .. import (models, schemas, utils, oauth2, databases, images,
+                votes_service)
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
-# Specify the directory path
+# Specify the directory path, created on startup by main.lifespan
 profile_pictures_directory = "profile_pictures"
 
-if not os.path.exists(profile_pictures_directory):
-    os.makedirs(profile_pictures_directory)
-
-router.mount("/profile_pictures",
-             StaticFiles(directory="profile_pictures"),
-             name="profile_pictures")
-
 
 # Create a new user
 @router.post("/register",
              name="Create User Account",
-             status_code=status.HTTP_201_CREATED)
-async def register(user: schemas.RegisterUser, db: Session = Depends(get_db)):
+             status_code=status.HTTP_201_CREATED,
+             response_model=schemas.RegisterUserResponse)
+async def register(user: schemas.RegisterUser,
+                   db: AsyncSession = Depends(get_db)):
 
     try:
         # Validate required fields
@@ -42,10 +38,10 @@ async def register(user: schemas.RegisterUser, db: Session = Depends(get_db)):
                                 detail="All fields are required.")
 
         # Check if the user's email or phone already exists
-        existing_user_email = (db.query(
-            models.Users).filter(models.Users.email == user.email).first())
-        existing_user_phone = (db.query(
-            models.Users).filter(models.Users.phone == user.phone).first())
+        existing_user_email = await db.scalar(
+            select(models.Users).where(models.Users.email == user.email))
+        existing_user_phone = await db.scalar(
+            select(models.Users).where(models.Users.phone == user.phone))
 
         if existing_user_email and existing_user_phone:
             raise HTTPException(
@@ -65,14 +61,14 @@ async def register(user: schemas.RegisterUser, db: Session = Depends(get_db)):
             )
 
         # Hash the password and store
-        hashed_pwd = utils.hash_password(user.password)
+        hashed_pwd = await utils.hash_password_async(user.password)
         user.password = hashed_pwd
 
         new_user = models.Users(**user.model_dump())
 
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
 
         # Create a UserDetail instance from the Users model
         user_detail = schemas.UserDetail.from_users_model(new_user)
@@ -96,23 +92,39 @@ async def register(user: schemas.RegisterUser, db: Session = Depends(get_db)):
 
 
 # Login User
-@router.post("/login", name="User Login", status_code=status.HTTP_200_OK)
+@router.post("/login",
+             name="User Login",
+             status_code=status.HTTP_200_OK,
+             response_model=schemas.UserLoginResponse)
 async def login_user(user_credentials: OAuth2PasswordRequestForm = Depends(),
-                     db: Session = Depends(databases.get_db)):
+                     inline_images: bool = Query(
+                         False,
+                         description="Embed images as base64 instead of URLs"),
+                     db: AsyncSession = Depends(databases.get_db)):
 
     try:
-        user = db.query(models.Users).filter(
-            models.Users.email == user_credentials.username).first()
+        user = await db.scalar(
+            select(models.Users).where(
+                models.Users.email == user_credentials.username))
 
         if not user:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail="Invalid username or password")
 
-        if not utils.verify_password(user_credentials.password, user.password):
+        is_valid, new_hash = await utils.verify_and_update_password(
+            user_credentials.password, user.password)
+
+        if not is_valid:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail="Invalid username or password")
 
-        user_detail = schemas.UserLogin.from_db(user)
+        # Transparently move the stored hash to the configured bcrypt cost
+        if new_hash:
+            user.password = new_hash
+            await db.commit()
+            oauth2.invalidate_cached_user(user.id)
+
+        user_detail = schemas.UserLogin.from_db(user, inline_images)
 
         access_token = oauth2.create_access_token(data={"user_id": user.id})
 
@@ -137,13 +149,16 @@ async def login_user(user_credentials: OAuth2PasswordRequestForm = Depends(),
 # Get All Users
 @router.get("/get_all_users",
             name="Get All the users",
-            status_code=status.HTTP_200_OK)
+            status_code=status.HTTP_200_OK,
+            response_model=schemas.UserListResponse)
 async def get_all_users(skip: int = Query(0, description="Skip this many records", ge=0),
-    limit: int = Query(0, description="Limit the number of records", le=0),
-        db: Session = Depends(get_db),
+    limit: int = Query(20, description="Limit the number of records", ge=1, le=100),
+    after_id: Optional[int] = Query(None, description="Only users with a greater id, use next_after_id of the previous page"),
+    inline_images: bool = Query(False, description="Embed images as base64 instead of URLs"),
+        db: AsyncSession = Depends(get_db),
         current_user: int = (Depends(oauth2.get_current_user))):
     try:
-        query = db.query(models.Users).options(
+        query = select(models.Users).options(
             load_only(models.Users.id, models.Users.first_name,
                       models.Users.last_name, models.Users.phone,
                       models.Users.profile_pic, models.Users.email,
@@ -151,17 +166,17 @@ async def get_all_users(skip: int = Query(0, description="Skip this many records
 
         query = query.order_by(asc(models.Users.id))
 
-        if not skip and not limit:
-            users = query.all()
-
-        elif skip:
-            users = query.offset(skip).all()
+        # Keyset pagination on the primary key, cheaper than a large skip
+        if after_id is not None:
+            query = query.where(models.Users.id > after_id)
 
-        elif limit:
-            users = query.limit(limit).all()
+        # Fetch one extra row to know whether another page exists
+        users = (await db.scalars(query.offset(skip).limit(limit + 1))).all()
 
-        else:
-            users = query.offset(skip).limit(limit).all()
+        next_after_id = None
+        if len(users) > limit:
+            users = users[:limit]
+            next_after_id = users[-1].id
 
         if not current_user.id:
             raise HTTPException(
@@ -172,30 +187,16 @@ async def get_all_users(skip: int = Query(0, description="Skip this many records
                 
         user_details = []
         for user in users:
-           
-            profile_pic_path = f"profile_pictures/{user.id}.jpg"
-            
-            if os.path.isfile(profile_pic_path):
-                with open(profile_pic_path, "rb") as image_file:
-                    encoded_profile_pic = base64.b64encode(image_file.read()).decode("utf-8")
-            else:
-                # Set a default or placeholder image if no image is available
-                encoded_profile_pic = None
-            
-            user_detail = schemas.UserDetail(id=user.id,
-                                             first_name=user.first_name,
-                                             last_name=user.last_name,
-                                             phone=user.phone,
-                                             email=user.email,
-                                             profile_pic=encoded_profile_pic,
-                                             updated_by=user.updated_by)
+            user_detail = schemas.UserDetail.from_users_model(
+                user, inline_images)
             user_details.append(user_detail)
-       
+
         total_users_count = len(user_details)
         
         response_model = schemas.UserListResponse(message=response_message,
                                                   total_users_count=total_users_count,
-                                                  users_list=user_details)
+                                                  users_list=user_details,
+                                                  next_after_id=next_after_id)
         
         return response_model        
 
@@ -213,12 +214,18 @@ async def get_all_users(skip: int = Query(0, description="Skip this many records
 # Get users by id
 @router.get("/get_user/{id}",
             name="Get users by ID",
-            status_code=status.HTTP_200_OK)
+            status_code=status.HTTP_200_OK,
+            response_model=schemas.GetUsersByIDResponse)
 async def get_user_by_id(id: int,
-                         db: Session = Depends(get_db),
+                         request: Request,
+                         response: Response,
+                         inline_images: bool = Query(
+                             False,
+                             description="Embed images as base64 instead of URLs"),
+                         db: AsyncSession = Depends(get_db),
                          current_user: int = Depends(oauth2.get_current_user)):
 
-    user = db.query(models.Users).filter(models.Users.id == id).first()
+    user = await db.get(models.Users, id)
     print("users:", user)
     try:
         if user is None:
@@ -232,9 +239,19 @@ async def get_user_by_id(id: int,
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You are not authorised to do get all users.")
 
+        etag = utils.make_etag("user", user.id, user.updated_by,
+                               inline_images)
+        headers = utils.conditional_headers(etag, user.updated_by)
+
+        if utils.is_not_modified(request, etag, user.updated_by):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                            headers=headers)
+
+        response.headers.update(headers)
+
         response_message = "User data Fetched Successfully."
 
-        user_detail = schemas.UserDetail.from_users_model(user)
+        user_detail = schemas.UserDetail.from_users_model(user, inline_images)
 
         response_model = schemas.GetUsersByIDResponse(message=response_message,
                                                       user_detail=user_detail)
@@ -258,10 +275,11 @@ async def get_user_by_id(id: int,
     "/update_user/{id}",
     name="Update user profile detals",
     status_code=status.HTTP_200_OK,
+    response_model=schemas.UpdateUserDetailResponse,
 )
 async def update_user(id: int,
                       update_user: schemas.UpdateUserDetail = Body(...),
-                      db: Session = Depends(get_db),
+                      db: AsyncSession = Depends(get_db),
                       current_user: int = Depends(oauth2.get_current_user)):
 
     try:
@@ -269,13 +287,15 @@ async def update_user(id: int,
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail='Access not granted to do this action')
 
-        existing_user_email = db.query(models.Users).filter(
-            models.Users.id != id,
-            models.Users.email == update_user.email).first()
+        existing_user_email = await db.scalar(
+            select(models.Users).where(
+                models.Users.id != id,
+                models.Users.email == update_user.email))
 
-        existing_user_phone = db.query(models.Users).filter(
-            models.Users.id != id,
-            models.Users.phone == update_user.phone).first()
+        existing_user_phone = await db.scalar(
+            select(models.Users).where(
+                models.Users.id != id,
+                models.Users.phone == update_user.phone))
 
         if existing_user_email:
             raise HTTPException(
@@ -287,7 +307,7 @@ async def update_user(id: int,
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f'Phone {update_user.phone} already exists.')
 
-        user = db.query(models.Users).filter(models.Users.id == id).first()
+        user = await db.get(models.Users, id)
 
         if not user:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
@@ -305,10 +325,14 @@ async def update_user(id: int,
         if update_user.phone:
             user.phone = update_user.phone
 
-        db.commit()
+        # Bump updated_by so cached copies (ETags) are invalidated
+        user.updated_by = func.now()
+
+        await db.commit()
+        await db.refresh(user)
+        oauth2.invalidate_cached_user(id)
 
-        updated_user = db.query(
-            models.Users).filter(models.Users.id == id).first()
+        updated_user = await db.get(models.Users, id)
 
         updated_user_detail = schemas.UserDetail.from_users_model(updated_user)
 
@@ -334,17 +358,16 @@ async def update_user(id: int,
 # The password should be send in body as raw json format
 @router.put("/update_password/{id}",
             name="Update or change password",
-            status_code=status.HTTP_200_OK)
+            status_code=status.HTTP_200_OK,
+            response_model=schemas.CommonMessageResponse)
 async def update_password(id: int,
                           new_password: schemas.UpdatePassword = Body(...),
-                          db: Session = Depends(get_db),
+                          db: AsyncSession = Depends(get_db),
                           current_user: int = Depends(
                               oauth2.get_current_user)):
 
     try:
-        user_query = db.query(models.Users).filter(models.Users.id == id)
-
-        user = user_query.first()
+        user = await db.get(models.Users, id)
 
         if current_user.id != user.id:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
@@ -356,13 +379,14 @@ async def update_password(id: int,
 
         password = new_password.password
 
-        hashed_pwd = utils.hash_password(password)
+        hashed_pwd = await utils.hash_password_async(password)
 
         user.password = hashed_pwd
 
         print('hashed_pwd', hashed_pwd)
 
-        db.commit()
+        await db.commit()
+        oauth2.invalidate_cached_user(id)
 
         response_mesage = "Password updated successfully."
 
@@ -384,15 +408,16 @@ async def update_password(id: int,
 # Upload Profile Picture
 @router.post("/upload_profile_pic/{id}",
              name="Upload your profile picture",
-             status_code=status.HTTP_200_OK)
+             status_code=status.HTTP_200_OK,
+             response_model=schemas.UpdateProfileResponse)
 async def upload_profile_pic(id: int,
                              profile_pic: UploadFile = File(...),
-                             db: Session = Depends(get_db),
+                             db: AsyncSession = Depends(get_db),
                              current_user: str = Depends(
                                  oauth2.get_current_user)):
 
     try:
-        user = db.query(models.Users).filter(models.Users.id == id).first()
+        user = await db.get(models.Users, id)
 
         if not user:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -402,32 +427,55 @@ async def upload_profile_pic(id: int,
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail="Not authorized.")
 
-        allowed_formats = ["jpeg", "jpg", "png", "heic"]
+        allowed_formats = images.allowed_extensions()
         file_extension = profile_pic.filename.split(".")[-1].lower()
 
         if file_extension not in allowed_formats:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                                 detail="Invalid file format")
 
-        file_path = f'profile_pictures/{user.id}.jpg'
-
-        # Check if the file already exists and remove it
-        if os.path.exists(file_path):
-            os.remove(file_path)
-
-        with open(file_path, "wb") as f:
-            f.write(await profile_pic.read())
-
-        # Optionally, convert HEIC to JPEG (requires Pillow library)
-        if file_extension == "heic":
-            img = Image.open(file_path)
-            img = img.convert("RGB")
-            img.save(file_path.replace("heic", "jpg", "png"), "JPEG")
-            os.remove(file_path)  # Remove the original HEIC file
-
-        user.profile_pic = file_path
-
-        db.commit()
+        # End the read transaction so its connection goes back to the pool
+        # while the upload is saved and resized; the user object stays
+        # usable as sessions don't expire on commit
+        await db.commit()
+
+        # Every upload gets a new random name, like post images, so picture
+        # URLs can't be guessed from user ids and a new picture never reuses
+        # a cached URL
+        output_base = os.path.join(profile_pictures_directory,
+                                   f"{uuid.uuid4().hex}_{user.id}_profile")
+        upload_path = f"{output_base}_upload.{file_extension}"
+
+        await utils.save_upload_file(profile_pic, upload_path)
+        await utils.check_image_upload(upload_path)
+
+        previous_profile_pic = user.profile_pic
+
+        try:
+            # Decoded and resized in the image worker pool, off the event
+            # loop
+            renditions = await images.process_image_async(
+                upload_path, output_base)
+
+            user.profile_pic = renditions["full"]
+            user.updated_by = func.now()
+
+            await db.commit()
+        except Exception:
+            # Leave neither the upload nor any finished rendition behind
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+            delete_file_in_path(
+                images.rendition_path(output_base, "full",
+                                      settings.image_format.upper()))
+            raise
+
+        await db.refresh(user)
+        oauth2.invalidate_cached_user(id)
+
+        # The old picture is only removed once nothing points to it anymore
+        if previous_profile_pic:
+            delete_file_in_path(previous_profile_pic)
 
         response_message = "Profile picture uploaded successfully"
 
@@ -443,7 +491,8 @@ async def upload_profile_pic(id: int,
         raise http_exception
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        print(f'Internal Server Error: {str(e)}')
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Internal server error.")
 
@@ -453,10 +502,10 @@ async def upload_profile_pic(id: int,
             name="Get profile picture URL",
             status_code=status.HTTP_200_OK)
 async def get_profile_picture_url(id: int,
-                                  db: Session = Depends(get_db),
+                                  db: AsyncSession = Depends(get_db),
                                   current_user: str = Depends(
                                       oauth2.get_current_user)):
-    user = db.query(models.Users).filter(models.Users.id == id).first()
+    user = await db.get(models.Users, id)
 
     if current_user.id != id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
@@ -466,8 +515,7 @@ async def get_profile_picture_url(id: int,
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="User or profile picture not found")
 
-    # Construct the file path to the user's profile picture
-    file_path = f"profile_pictures/{user.id}.jpg"
+    file_path = user.profile_pic
 
     try:
         # Check if the file exists
@@ -475,7 +523,7 @@ async def get_profile_picture_url(id: int,
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail="Profile picture file not found")
 
-        return FileResponse(file_path, media_type="image/jpeg")
+        return FileResponse(file_path)
 
     # Re-raise the HTTP exception
     except HTTPException as http_exception:
@@ -491,23 +539,24 @@ async def get_profile_picture_url(id: int,
 # Delete user by id
 @router.delete("/delete_user/{id}",
                name="Delete user account",
-               status_code=status.HTTP_200_OK)
+               status_code=status.HTTP_200_OK,
+               response_model=schemas.CommonMessageResponse)
 async def delete_user(id: int,
-                      db: Session = Depends(get_db),
+                      db: AsyncSession = Depends(get_db),
                       current_user: str = Depends(oauth2.get_current_user)):
     try:
         if current_user.id != id:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail='Access not granted to do this action')
 
-        user_query = db.query(models.Users).filter(models.Users.id == id)
-        user = user_query.first()
+        user = await db.get(models.Users, id)
 
         if not user:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f'User with id: {id} does not exists.')
 
-        posts = db.query(models.Post).filter(models.Post.user_id == id).all()
+        posts = (await db.scalars(
+            select(models.Post).where(models.Post.user_id == id))).all()
 
         for post in posts:
             if post.post_image:
@@ -516,9 +565,11 @@ async def delete_user(id: int,
         if user.profile_pic:
             delete_file_in_path(user.profile_pic)
 
-        user_query.delete(synchronize_session=False)
+        await votes_service.delete_user_votes(db, id)
+        await db.execute(delete(models.Users).where(models.Users.id == id))
 
-        db.commit()
+        await db.commit()
+        oauth2.invalidate_cached_user(id)
 
         response_message = "User deleted successfully."
 
@@ -535,17 +586,21 @@ async def delete_user(id: int,
                             detail=error_message)
 
 
+# Deletes a stored image together with all of its renditions
 def delete_file_in_path(file_path):
-    try:
-        # Check if the file exists
-        if os.path.exists(file_path):
-            print(f"Deleting file: {file_path}")
-            # Split the file path to get the directory and file name
-            directory, file_name = os.path.split(file_path)
-
-            # Delete the file without removing the directory
-            os.remove(os.path.join(directory, file_name))
-        else:
-            print(f"File not found: {file_path}")
-    except Exception as e:
-        print(f"Error deleting file: {str(e)}")
+    schemas.invalidate_encoded_image(file_path)
+
+    for rendition_path in images.rendition_paths(file_path).values():
+        try:
+            # Check if the file exists
+            if os.path.exists(rendition_path):
+                print(f"Deleting file: {rendition_path}")
+                # Split the file path to get the directory and file name
+                directory, file_name = os.path.split(rendition_path)
+
+                # Delete the file without removing the directory
+                os.remove(os.path.join(directory, file_name))
+            else:
+                print(f"File not found: {rendition_path}")
+        except Exception as e:
+            print(f"Error deleting file: {str(e)}")
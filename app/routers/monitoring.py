@@ -0,0 +1,56 @@
+from fastapi import status, APIRouter, Depends
+from .. import schemas, databases, cache, vote_buffer, oauth2
+
+# Internal operational data, only for logged in users
+router = APIRouter(prefix="/monitoring",
+                   tags=["Monitoring"],
+                   dependencies=[Depends(oauth2.get_current_user)])
+
+
+# Connection pool usage of this worker process
+@router.get("/pool_stats",
+            name="Database connection pool stats",
+            status_code=status.HTTP_200_OK,
+            response_model=schemas.PoolStatsResponse)
+async def pool_stats():
+    response_message = "Pool stats fetched successfully."
+
+    pool_stats = schemas.PoolStats(**databases.get_pool_stats())
+
+    return schemas.PoolStatsResponse(message=response_message,
+                                     pool_stats=pool_stats)
+
+
+# Hit/miss counters of the in-process caches of this worker process
+@router.get("/cache_stats",
+            name="In-process cache stats",
+            status_code=status.HTTP_200_OK,
+            response_model=schemas.CacheStatsResponse)
+async def cache_stats():
+    response_message = "Cache stats fetched successfully."
+
+    caches = {
+        name: schemas.CacheStats(**ttl_cache.stats())
+        for name, ttl_cache in cache.caches.items()
+    }
+
+    return schemas.CacheStatsResponse(message=response_message, caches=caches)
+
+
+# Write-behind vote buffer counters of this worker process
+@router.get("/vote_buffer_stats",
+            name="Vote buffer stats",
+            status_code=status.HTTP_200_OK,
+            response_model=schemas.VoteBufferStatsResponse)
+async def vote_buffer_stats():
+    response_message = "Vote buffer stats fetched successfully."
+
+    buffer = vote_buffer.vote_buffer
+
+    if buffer is None:
+        stats = schemas.VoteBufferStats(enabled=False)
+    else:
+        stats = schemas.VoteBufferStats(enabled=True, **buffer.stats())
+
+    return schemas.VoteBufferStatsResponse(message=response_message,
+                                           vote_buffer=stats)
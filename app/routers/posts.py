@@ -1,25 +1,70 @@
-import base64
 import os
-from PIL import Image
+import uuid
 from pathlib import Path
-from fastapi import HTTPException, status, APIRouter, Depends, UploadFile, File, Form
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException, status, APIRouter, Depends, UploadFile, File, Form, Query, BackgroundTasks, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from sqlalchemy import desc, tuple_, select, update, delete, func
 from ..databases import get_db
-from .. import models, oauth2, schemas
+from .. import models, oauth2, schemas, utils, images, databases, ranking
+from ..config import settings
 
 router = APIRouter(prefix="/post", tags=["Posts"])
 
-# Specify the directory path
+# Specify the directory path, created on startup by main.lifespan
 post_images_directory = "posts_images"
 
-if not os.path.exists(post_images_directory):
-    os.makedirs(post_images_directory)
 
-router.mount("/posts_images",
-             StaticFiles(directory="posts_images"),
-             name="posts_images")
+# Posts are always returned with their author; lazy loading is not
+# available on an AsyncSession so the relationship is loaded up front, in
+# the same statement (every post has an author, hence the inner join).
+def select_posts():
+    return select(models.Post).options(
+        joinedload(models.Post.user_detail, innerjoin=True))
+
+
+async def get_post_with_author(db: AsyncSession, post_id: int):
+    return await db.scalar(select_posts().where(
+        models.Post.post_id == post_id).execution_options(
+            populate_existing=True))
+
+
+# One page of ready posts in descending (sort_column, post_id) order.
+# Keyset pagination: seek past the last row of the previous page instead of
+# OFFSET, so every page is a range scan on the matching composite index
+# whatever the depth. Returns the posts and the cursor of the next page.
+async def fetch_posts_page(db: AsyncSession, sort_column, sort_type,
+                           after: Optional[str], limit: int):
+    query = select_posts().where(models.Post.is_ready)
+
+    if after:
+        try:
+            after_sort_value, after_post_id = utils.decode_cursor(
+                after, sort_type)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="Invalid cursor.")
+
+        query = query.where(
+            tuple_(sort_column, models.Post.post_id) < tuple_(
+                after_sort_value, after_post_id))
+
+    # Fetch one extra row to know whether another page exists
+    posts = (await db.scalars(
+        query.order_by(desc(sort_column),
+                       desc(models.Post.post_id)).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        last_post = posts[-1]
+        next_cursor = utils.encode_cursor(
+            getattr(last_post, sort_column.key), last_post.post_id)
+
+    return posts, next_cursor
+
 
 #CRUD Operations
 
@@ -27,75 +72,61 @@ router.mount("/posts_images",
 # Create a new post
 @router.post("/create_post",
              name="Create a new post",
-             status_code=status.HTTP_201_CREATED)
-async def create_post(post: schemas.CreatePost = Depends(
-    schemas.CreatePost.as_form),
+             status_code=status.HTTP_201_CREATED,
+             response_model=schemas.CreatePostResponse)
+async def create_post(background_tasks: BackgroundTasks,
+                      post: schemas.CreatePost = Depends(
+                          schemas.CreatePost.as_form),
                       image: UploadFile = File(...),
-                      db: Session = Depends(get_db),
+                      db: AsyncSession = Depends(get_db),
                       current_user: int = Depends(oauth2.get_current_user)):
 
     try:
-        user = db.query(
-            models.Users).filter(models.Users.id == current_user.id).first()
-        user_id = user.id
-
-        posts = db.query(models.Post).all()
+        user_id = current_user.id
 
-        if posts:
-            last_post_id = posts[-1].post_id
-            next_post_id = last_post_id + 1
-
-        else:
-            last_post_id = None
-            next_post_id = 1
-
-        allowed_formats = ["jpeg", "jpg", "png", "heic"]
+        allowed_formats = images.allowed_extensions()
         file_extension = image.filename.split(".")[-1].lower()
 
         if file_extension not in allowed_formats:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                                 detail="Invalid file format")
 
-        # Save the image to the server
-        image_path = os.path.join("posts_images",
-                                  f"{next_post_id}_{user_id}_post.jpg")
-        with open(image_path, "wb") as image_file:
-            image_file.write(await image.read())
-
-        # Optionally, convert HEIC to JPEG (requires Pillow library)
-        if file_extension == "heic":
-            img = Image.open(image_path)
-            img = img.convert("RGB")
-            img.save(image_path.replace("heic", "jpg", "png"), "JPEG")
-            os.remove(image_path)  # Remove the original HEIC file
-
+        # get_current_user may have loaded the user with this session; end
+        # that transaction so its connection goes back to the pool while
+        # the upload is saved and checked
+        await db.commit()
+
+        # Save the image to the server. The name is random rather than derived
+        # from the next post id, so no lookup is needed and concurrent
+        # uploads can't collide.
+        output_base = os.path.join(post_images_directory,
+                                   f"{uuid.uuid4().hex}_{user_id}_post")
+        upload_path = f"{output_base}_upload.{file_extension}"
+        await utils.save_upload_file(image, upload_path)
+        await utils.check_image_upload(upload_path)
+
+        # The post stays unpublished in the feed until its renditions exist
         new_post = models.Post(user_id=user_id,
-                               post_image=image_path,
+                               post_image=upload_path,
+                               is_ready=False,
+                               hot_score=ranking.hot_score(0, func.now()),
                                **post.model_dump())
 
         db.add(new_post)
-        db.commit()
-        db.refresh(new_post)
+        await db.commit()
 
-        new_post_response = schemas.PostResponseBase.from_db(new_post)
+        # Reload with the author and the server-side defaults
+        new_post = await get_post_with_author(db, new_post.post_id)
 
-        vote_count = 0
+        background_tasks.add_task(process_post_image, new_post.post_id,
+                                  upload_path, output_base)
 
-        response_message = "Post posted succesfully."
+        new_post_response = schemas.PostResponseBase.from_db(new_post)
 
-        response_model = schemas.PostResponseBase(
-            post_id=new_post_response.post_id,
-            user_id=new_post_response.user_id,
-            caption=new_post_response.caption,
-            is_published=new_post_response.is_published,
-            post_image=new_post_response.post_image,
-            updated_by=new_post_response.updated_by,
-            user_detail=new_post_response.user_detail,
-            votes=vote_count)
+        response_message = "Post posted succesfully."
 
         return schemas.CreatePostResponse(message=response_message,
-                                          post_detail=response_model,
-                                          votes=vote_count)
+                                          post_detail=new_post_response)
 
     # Re-raise the HTTP exception
     except HTTPException as http_exception:
@@ -107,18 +138,20 @@ async def create_post(post: schemas.CreatePost = Depends(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=error_message)
 
-# Function to encode an image to base64
-def encode_image_to_base64(image_path):
-    with open(image_path, "rb") as image_file:
-        encoded_image = base64.b64encode(image_file.read())
-    return encoded_image.decode("utf-8")
-
-
 # Get all the posts
 @router.get("/get_all_post",
             name="Get All the posts",
-            status_code=status.HTTP_200_OK)
-async def get_all_posts(db: Session = Depends(get_db),
+            status_code=status.HTTP_200_OK,
+            response_model=schemas.GetPostsResponse)
+async def get_all_posts(after: Optional[str] = Query(
+    None, description="Cursor returned as next_cursor by the previous page"),
+                        limit: int = Query(
+                            20, description="Number of posts per page",
+                            ge=1, le=100),
+                        inline_images: bool = Query(
+                            False,
+                            description="Embed images as base64 instead of URLs"),
+                        db: AsyncSession = Depends(get_db),
                         current_user: int = Depends(oauth2.get_current_user)):
 
     try:
@@ -126,36 +159,74 @@ async def get_all_posts(db: Session = Depends(get_db),
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail="You are not authorised to use this.")
 
-        posts_with_votes = (db.query(
-            models.Post,
-            func.count(models.Votes.post_id).label("votes")).outerjoin(
-                models.Votes,
-                models.Votes.post_id == models.Post.post_id).group_by(
-                    models.Post.post_id).all())
+        posts, next_cursor = await fetch_posts_page(db, models.Post.updated_by,
+                                                    datetime, after, limit)
 
         response_message = "All posts fetched successfully."
 
-        total_posts = len(posts_with_votes)
+        total_posts = len(posts)
 
         post_response = [
-            schemas.PostResponseBase(
-                post_id=post.post_id,  # Use 'post' instead of 'posts' here
-                user_id=post.user_id,
-                caption=post.caption,
-                is_published=post.is_published,
-                post_image=encode_image_to_base64(post.post_image),
-                updated_by=post.updated_by,
-                user_detail=schemas.UserDetail.from_users_model(
-                    post.user_detail),
-                votes=votes if votes else 0,
-                profile_picture_base64=encode_image_to_base64(post.user_detail.profile_pic))
-            for (post, votes
-                 ) in posts_with_votes  # Use 'votes' instead of 'posts' here
+            schemas.PostResponseBase.from_db(post, inline_images=inline_images)
+            for post in posts
         ]
 
         response_model = schemas.GetPostsResponse(message=response_message,
                                                   total_posts=total_posts,
-                                                  post_details=post_response)
+                                                  post_details=post_response,
+                                                  next_cursor=next_cursor)
+
+        return response_model
+
+    # Re-raise the HTTP exception
+    except HTTPException as http_exception:
+        raise http_exception
+
+    except Exception as e:
+        error_message = "Internal Server Error: An unexpected error occurred."
+        print(f'Internal Server Error: {str(e)}')
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=error_message)
+
+
+# Ranked home feed, hottest posts first
+@router.get("/feed",
+            name="Get the ranked feed",
+            status_code=status.HTTP_200_OK,
+            response_model=schemas.GetPostsResponse)
+async def get_ranked_feed(after: Optional[str] = Query(
+    None, description="Cursor returned as next_cursor by the previous page"),
+                          limit: int = Query(
+                              20, description="Number of posts per page",
+                              ge=1, le=100),
+                          inline_images: bool = Query(
+                              False,
+                              description="Embed images as base64 instead of URLs"),
+                          db: AsyncSession = Depends(get_db),
+                          current_user: int = Depends(
+                              oauth2.get_current_user)):
+
+    try:
+        if not current_user:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                detail="You are not authorised to use this.")
+
+        # Scores are precomputed by create_post and post_vote, so this is a
+        # range scan on ix_posts_hot_score_post_id
+        posts, next_cursor = await fetch_posts_page(db, models.Post.hot_score,
+                                                    float, after, limit)
+
+        response_message = "Feed fetched successfully."
+
+        post_response = [
+            schemas.PostResponseBase.from_db(post, inline_images=inline_images)
+            for post in posts
+        ]
+
+        response_model = schemas.GetPostsResponse(message=response_message,
+                                                  total_posts=len(posts),
+                                                  post_details=post_response,
+                                                  next_cursor=next_cursor)
 
         return response_model
 
@@ -173,9 +244,15 @@ async def get_all_posts(db: Session = Depends(get_db),
 # Get an individual post by id
 @router.get("/get_post/{post_id}",
             name="Get post by ID",
-            status_code=status.HTTP_200_OK)
+            status_code=status.HTTP_200_OK,
+            response_model=schemas.GetIndividualPostResponse)
 async def get_user_by_id(post_id: int,
-                         db: Session = Depends(get_db),
+                         request: Request,
+                         response: Response,
+                         inline_images: bool = Query(
+                             False,
+                             description="Embed images as base64 instead of URLs"),
+                         db: AsyncSession = Depends(get_db),
                          current_user: int = Depends(oauth2.get_current_user)):
 
     try:
@@ -183,16 +260,31 @@ async def get_user_by_id(post_id: int,
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail="You are not authorised to use this.")
 
-        post = db.query(
-            models.Post).filter(models.Post.post_id == post_id).first()
+        post = await get_post_with_author(db, post_id)
 
         if not post:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f'Post with id: {post_id} not found.')
 
+        # The body only changes with the post, its vote count, its image or
+        # its author. Votes and image processing don't move updated_by, so
+        # posts are revalidated by ETag only, without Last-Modified.
+        etag = utils.make_etag("post", post.post_id, post.updated_by,
+                               post.vote_count, post.is_ready,
+                               post.post_image, post.user_detail.updated_by,
+                               inline_images)
+        headers = utils.conditional_headers(etag)
+
+        if utils.is_not_modified(request, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                            headers=headers)
+
+        response.headers.update(headers)
+
         response_message = "Post fetched successfully."
 
-        post_response = schemas.PostResponseBase.from_db(post)
+        post_response = schemas.PostResponseBase.from_db(
+            post, inline_images=inline_images)
 
         response_model = schemas.GetIndividualPostResponse(
             message=response_message, post_detail=post_response)
@@ -213,17 +305,15 @@ async def get_user_by_id(post_id: int,
 # Update a post:
 @router.put("/update_post/{post_id}",
             name="Update post by id",
-            status_code=status.HTTP_200_OK)
+            status_code=status.HTTP_200_OK,
+            response_model=schemas.CreatePostResponse)
 async def update_post(post_id: int,
                       update_post: schemas.CreatePost,
-                      db: Session = Depends(get_db),
+                      db: AsyncSession = Depends(get_db),
                       current_user: int = Depends(oauth2.get_current_user)):
 
     try:
-        post_query = db.query(
-            models.Post).filter(models.Post.post_id == post_id)
-
-        post = post_query.first()
+        post = await db.get(models.Post, post_id)
 
         if post == None:
             raise HTTPException(
@@ -234,31 +324,20 @@ async def update_post(post_id: int,
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail=f'Not authorized to do this action.')
 
-        post_query.update(update_post.model_dump(), synchronize_session=False)
+        await db.execute(
+            update(models.Post).where(models.Post.post_id == post_id).values(
+                **update_post.model_dump(), updated_by=func.now()))
 
-        db.commit()
+        await db.commit()
 
-        update_post = post_query.first()
+        update_post = await get_post_with_author(db, post_id)
 
         update_post_response = schemas.PostResponseBase.from_db(update_post)
 
-        vote_count = 0
-
         response_message = "Post posted succesfully."
 
-        response_model = schemas.PostResponseBase(
-            post_id=update_post_response.post_id,
-            user_id=update_post_response.user_id,
-            caption=update_post_response.caption,
-            is_published=update_post_response.is_published,
-            post_image=update_post_response.post_image,
-            updated_by=update_post_response.updated_by,
-            user_detail=update_post_response.user_detail,
-            votes=vote_count)
-
         return schemas.CreatePostResponse(message=response_message,
-                                          post_detail=response_model,
-                                          votes=vote_count)
+                                          post_detail=update_post_response)
 
     # Re-raise the HTTP exception
     except HTTPException as http_exception:
@@ -274,16 +353,14 @@ async def update_post(post_id: int,
 # Delete post by ID
 @router.delete("/delete_post/{post_id}",
                name="Delete a post by ID",
-               status_code=status.HTTP_200_OK)
+               status_code=status.HTTP_200_OK,
+               response_model=schemas.CommonMessageResponse)
 async def delete_post(post_id: int,
-                      db: Session = Depends(get_db),
+                      db: AsyncSession = Depends(get_db),
                       current_user: int = Depends(oauth2.get_current_user)):
 
     try:
-        post_query = db.query(
-            models.Post).filter(models.Post.post_id == post_id)
-
-        post = post_query.first()
+        post = await db.get(models.Post, post_id)
 
         if post == None:
             raise HTTPException(
@@ -298,8 +375,9 @@ async def delete_post(post_id: int,
         if post.post_image:
             delete_file_in_path(post.post_image)
 
-        post_query.delete(synchronize_session=False)
-        db.commit()
+        await db.execute(
+            delete(models.Post).where(models.Post.post_id == post_id))
+        await db.commit()
 
         response_message = "Post deleted successfully."
 
@@ -316,17 +394,57 @@ async def delete_post(post_id: int,
                             detail=error_message)
 
 
-def delete_file_in_path(file_path):
+# Background task run after create_post responds: build the renditions in
+# the image worker pool, then point the post at them and mark it ready.
+# The upload was checked to be an image, but if it still can't be decoded
+# the post would never become ready, so it is deleted with its files.
+async def process_post_image(post_id: int, upload_path: str,
+                             output_base: str):
     try:
-        # Check if the file exists
-        if os.path.exists(file_path):
-            print(f"Deleting file: {file_path}")
-            # Split the file path to get the directory and file name
-            directory, file_name = os.path.split(file_path)
-
-            # Delete the file without removing the directory
-            os.remove(os.path.join(directory, file_name))
-        else:
-            print(f"File not found: {file_path}")
+        renditions = await images.process_image_async(upload_path,
+                                                      output_base)
     except Exception as e:
-        print(f"Error deleting file: {str(e)}")
+        print(f'Image processing failed for post {post_id}, deleting it: '
+              f'{str(e)}')
+
+        async with databases.AsyncSessionLocal() as db:
+            await db.execute(
+                delete(models.Post).where(models.Post.post_id == post_id))
+            await db.commit()
+
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+        delete_file_in_path(
+            images.rendition_path(output_base, "full",
+                                  settings.image_format.upper()))
+        return
+
+    async with databases.AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(models.Post).where(models.Post.post_id == post_id).values(
+                post_image=renditions["full"], is_ready=True))
+        await db.commit()
+
+    # The post was deleted while its image was being processed
+    if result.rowcount == 0:
+        delete_file_in_path(renditions["full"])
+
+
+# Deletes a stored image together with all of its renditions
+def delete_file_in_path(file_path):
+    schemas.invalidate_encoded_image(file_path)
+
+    for rendition_path in images.rendition_paths(file_path).values():
+        try:
+            # Check if the file exists
+            if os.path.exists(rendition_path):
+                print(f"Deleting file: {rendition_path}")
+                # Split the file path to get the directory and file name
+                directory, file_name = os.path.split(rendition_path)
+
+                # Delete the file without removing the directory
+                os.remove(os.path.join(directory, file_name))
+            else:
+                print(f"File not found: {rendition_path}")
+        except Exception as e:
+            print(f"Error deleting file: {str(e)}")
@@ -1,72 +1,148 @@
-from fastapi import Depends, status, HTTPException, APIRouter
-from sqlalchemy.orm import Session
-from .. import (models, schemas, oauth2, databases)
-from typing import List
+from fastapi import Depends, status, HTTPException, APIRouter, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from .. import (models, schemas, oauth2, databases, vote_buffer,
+                votes_service)
 
 router = APIRouter(prefix="/vote", tags=["Votes"])
 
 
 @router.post("/post_vote",
              name="Give vote to post",
-             status_code=status.HTTP_200_OK)
+             status_code=status.HTTP_200_OK,
+             response_model=schemas.VoteResponse)
 async def post_vote(vote: schemas.Vote,
-                    db: Session = Depends(databases.get_db),
+                    response: Response,
+                    db: AsyncSession = Depends(databases.get_db),
                     current_user: int = Depends(oauth2.get_current_user)):
 
     try:
-        post = db.query(
-            models.Post).filter(models.Post.post_id == vote.post_id).first()
+        post = await db.get(models.Post, vote.post_id)
 
         if not post:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="The post: {vote.post_id} does not exists.")
 
-        vote_query = db.query(models.Votes).filter(
-            models.Votes.post_id == vote.post_id,
-            models.Votes.user_id == current_user.id)
+        # Write-behind mode: the vote is written by the next buffer flush,
+        # so duplicate votes and missing votes are not reported here
+        if vote_buffer.vote_buffer is not None:
+            vote_buffer.vote_buffer.add(current_user.id, vote.post_id,
+                                        vote.dir)
 
-        found_vote = vote_query.first()
+            response.status_code = status.HTTP_202_ACCEPTED
 
-        if vote.dir == 1:
-            if found_vote:
-                raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT,
-                    detail=
-                    f'User {current_user.id} has already voted on this post {vote.post_id}'
-                )
+            response_model = schemas.VoteResponse(
+                message="Vote accepted.", vote=vote)
 
-            new_vote = models.Votes(post_id=vote.post_id,
-                                    user_id=current_user.id)
-            db.add(new_vote)
-            db.commit()
-            db.refresh(new_vote)
+            return response_model
 
-            response_message_vote = "Vote posted successully."
+        # Same path as /vote/batch: the insert and delete report whether a
+        # row changed, so concurrent duplicate votes or unvotes can't move
+        # the counter twice
+        key = (current_user.id, vote.post_id)
+        result = (await votes_service.apply_votes(db, {key: vote.dir}))[key]
+        await db.commit()
 
-            response_vote = vote
+        if result == "already_voted":
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=
+                f'User {current_user.id} has already voted on this post {vote.post_id}'
+            )
 
-            response_model = schemas.VoteResponse(
-                message=response_message_vote, vote=response_vote)
+        if result == "not_voted":
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="Vote dosen't exists")
 
-            return response_model
+        if result == "post_not_found":
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"The post: {vote.post_id} does not exists.")
+
+        if result == "user_not_found":
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="User not found")
 
+        if result == "voted":
+            response_message = "Vote posted successully."
         else:
-            if not found_vote:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                    detail="Vote dosen't exists")
+            response_message = "Vote deleted successfully."
 
-            vote_query.delete(synchronize_session=False)
-            db.commit()
+        response_model = schemas.VoteResponse(message=response_message,
+                                              vote=vote)
 
-            response_message_delete = "Vote deleted successfully."
+        return response_model
 
-            response_vote = vote
+    # Re-raise the HTTP exception
+    except HTTPException as http_exception:
+        raise http_exception
 
-            response_model = schemas.VoteResponse(
-                message=response_message_delete, vote=response_vote)
+    except Exception as e:
+        error_message = "Internal Server Error: An unexpected error occurred."
+        print(f'Internal Server Error: {str(e)}')
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=error_message)
 
-            return response_model
+
+# Apply many votes at once, e.g. offline votes synced by a client. All
+# votes go through a multi-row INSERT ... ON CONFLICT DO NOTHING and a
+# DELETE ... RETURNING in a single transaction. When a post appears more
+# than once, the last vote for it wins and the earlier ones are reported
+# as superseded. In write-behind mode the votes join post_vote's in the
+# buffer instead, so a later flush can't undo them.
+@router.post("/batch",
+             name="Give votes to many posts",
+             status_code=status.HTTP_200_OK,
+             response_model=schemas.BatchVoteResponse)
+async def batch_vote(votes: schemas.VoteBatch,
+                     response: Response,
+                     db: AsyncSession = Depends(databases.get_db),
+                     current_user: int = Depends(oauth2.get_current_user)):
+
+    try:
+        last_vote_index = {
+            vote.post_id: index
+            for index, vote in enumerate(votes)
+        }
+
+        latest_votes = {(current_user.id, post_id): votes[index].dir
+                        for post_id, index in last_vote_index.items()}
+
+        buffer = vote_buffer.vote_buffer
+
+        if buffer is not None:
+            existing_post_ids = set((await db.scalars(
+                select(models.Post.post_id).where(
+                    models.Post.post_id.in_(list(last_vote_index))))).all())
+
+            outcomes = {}
+            for key, dir in latest_votes.items():
+                if key[1] in existing_post_ids:
+                    buffer.add(current_user.id, key[1], dir)
+                    outcomes[key] = "queued"
+                else:
+                    outcomes[key] = "post_not_found"
+
+            response.status_code = status.HTTP_202_ACCEPTED
+            response_message = "Votes accepted."
+
+        else:
+            outcomes = await votes_service.apply_votes(db, latest_votes)
+            await db.commit()
+            response_message = "Votes applied successfully."
+
+        results = []
+        for index, vote in enumerate(votes):
+            if last_vote_index[vote.post_id] != index:
+                result = "superseded"
+            else:
+                result = outcomes[(current_user.id, vote.post_id)]
+
+            results.append(schemas.BatchVoteResult(vote=vote, result=result))
+
+        return schemas.BatchVoteResponse(message=response_message,
+                                         results=results)
 
     # Re-raise the HTTP exception
     except HTTPException as http_exception:
@@ -1,9 +1,13 @@
-from pydantic import BaseModel, EmailStr, conint
+from pydantic import BaseModel, EmailStr, conint, conlist
 from datetime import datetime
 from .models import Users, Post
-from typing import List, Optional
+from typing import Dict, List, Optional
 from fastapi import Form
+from .cache import TTLCache
+from .config import settings
+from .images import rendition_paths
 import base64
+import os
 
 class CommonMessageResponse(BaseModel):
     message: str
@@ -34,14 +38,16 @@ class UserDetail(BaseModel):
     updated_by: datetime
 
     @classmethod
-    def from_users_model(cls, users: Users) -> 'UserDetail':
-        profile_picture_base64 = encode_image_to_base64(users.profile_pic) if users.profile_pic else None
+    def from_users_model(cls,
+                         users: Users,
+                         inline_images: bool = False) -> 'UserDetail':
+        profile_picture = render_image(users.profile_pic, inline_images)
         return cls(id=users.id,
                    first_name=users.first_name,
                    last_name=users.last_name,
                    phone=users.phone,
                    email=users.email,
-                   profile_pic=profile_picture_base64,
+                   profile_pic=profile_picture,
                    updated_by=users.updated_by)
 
     class Config:
@@ -66,14 +72,14 @@ class UserLogin(BaseModel):
     updated_by: datetime
 
     @classmethod
-    def from_db(cls, user):
-        profile_picture_base64 = encode_image_to_base64(user.profile_pic) if user.profile_pic else None
+    def from_db(cls, user, inline_images: bool = False):
+        profile_picture = render_image(user.profile_pic, inline_images)
         return cls(id=user.id,
                    first_name=user.first_name,
                    last_name=user.last_name,
                    phone=user.phone,
                    email=user.email,
-                   profile_pic=profile_picture_base64,
+                   profile_pic=profile_picture,
                    updated_by=user.updated_by)
 
 
@@ -91,6 +97,7 @@ class UserListResponse(BaseModel):
     message: str
     total_users_count: int
     users_list: List[UserDetail]
+    next_after_id: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -139,14 +146,16 @@ class UserDetailAfterProfileUpdate(BaseModel):
     updated_by: datetime
 
     @classmethod
-    def from_users_model(cls, users: Users) -> 'UserDetail':
-        profile_picture_base64 = encode_image_to_base64(users.profile_pic) if users.profile_pic else None
+    def from_users_model(cls,
+                         users: Users,
+                         inline_images: bool = False) -> 'UserDetail':
+        profile_picture = render_image(users.profile_pic, inline_images)
         return cls(id=users.id,
                    first_name=users.first_name,
                    last_name=users.last_name,
                    phone=users.phone,
                    email=users.email,
-                   profile_pic=profile_picture_base64,
+                   profile_pic=profile_picture,
                    updated_by=users.updated_by)
 
     class Config:
@@ -182,21 +191,36 @@ class PostResponseBase(BaseModel):
     user_id: int
     caption: str
     is_published: bool
-    post_image: str
+    # Only set once the image is processed, the raw upload isn't served
+    post_image: Optional[str] = None
+    post_image_renditions: Dict[str, str] = {}
+    is_ready: bool = True
     updated_by: datetime
     user_detail: UserDetail
     votes: int
 
     @classmethod
-    def from_db(cls, posts: Post):
+    def from_db(cls, posts: Post, inline_images: bool = False):
+        if posts.is_ready:
+            post_image = render_image(posts.post_image, inline_images)
+            renditions = {
+                name: image_url(path)
+                for name, path in rendition_paths(posts.post_image).items()
+            }
+        else:
+            post_image = None
+            renditions = {}
         return cls(post_id=posts.post_id,
                    user_id=posts.user_id,
                    caption=posts.caption,
                    is_published=posts.is_published,
-                   post_image=posts.post_image,
+                   post_image=post_image,
+                   post_image_renditions=renditions,
+                   is_ready=posts.is_ready,
                    updated_by=posts.updated_by,
-                   user_detail=posts.user_detail,
-                   votes=0)
+                   user_detail=UserDetail.from_users_model(
+                       posts.user_detail, inline_images),
+                   votes=posts.vote_count or 0)
 
     class Config:
         from_attributes = True
@@ -222,6 +246,7 @@ class GetPostsResponse(BaseModel):
     message: str
     total_posts: int
     post_details: List[PostResponseBase]
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -248,7 +273,112 @@ class VoteResponse(BaseModel):
     vote: Vote
 
 
+# Body of /vote/batch
+VoteBatch = conlist(Vote, min_length=1, max_length=500)
+
+
+class BatchVoteResult(BaseModel):
+    vote: Vote
+    # voted, already_voted, deleted, not_voted, post_not_found or
+    # superseded, or queued when votes are written behind
+    result: str
+
+
+class BatchVoteResponse(BaseModel):
+    message: str
+    results: List[BatchVoteResult]
+
+
+class PoolStats(BaseModel):
+    pool_size: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+    max_overflow: int
+    checkouts: int
+    avg_wait_ms: float
+    max_wait_ms: float
+
+
+class PoolStatsResponse(BaseModel):
+    message: str
+    pool_stats: PoolStats
+
+
+class CacheStats(BaseModel):
+    size: int
+    maxsize: int
+    nbytes: int
+    hits: int
+    misses: int
+
+
+class CacheStatsResponse(BaseModel):
+    message: str
+    caches: Dict[str, CacheStats]
+
+
+class VoteBufferStats(BaseModel):
+    enabled: bool
+    pending: int = 0
+    accepted: int = 0
+    coalesced: int = 0
+    flushes: int = 0
+    written: int = 0
+    skipped: int = 0
+    failed: int = 0
+
+
+class VoteBufferStatsResponse(BaseModel):
+    message: str
+    vote_buffer: VoteBufferStats
+
+
+# Base64 encoded images by path, stored with the mtime and size of the file
+# they were read from so a replaced file is never served stale
+encoded_image_cache = TTLCache("encoded_images",
+                               maxsize=settings.image_cache_size,
+                               ttl=settings.image_cache_ttl,
+                               maxbytes=settings.image_cache_max_bytes)
+
+
 def encode_image_to_base64(image_path: str) -> str:
+    stat_result = os.stat(image_path)
+    file_version = (stat_result.st_mtime_ns, stat_result.st_size)
+
+    cached = encoded_image_cache.get(image_path)
+    if cached is not None and cached[0] == file_version:
+        return cached[1]
+
     with open(image_path, "rb") as image_file:
-        encoded_image = base64.b64encode(image_file.read())
-        return encoded_image.decode('utf-8')
\ No newline at end of file
+        encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
+
+    encoded_image_cache.set(image_path, (file_version, encoded_image),
+                            nbytes=len(encoded_image))
+
+    return encoded_image
+
+
+# Must be called when an image file is replaced or deleted
+def invalidate_encoded_image(image_path: str):
+    for path in rendition_paths(image_path).values():
+        encoded_image_cache.invalidate(path)
+
+
+# Public URL of a stored image, served by the static mounts in main.py.
+# Every upload is stored under a new random name, so a replaced image
+# always gets a new URL and the URL needs no version.
+def image_url(image_path: str) -> str:
+    return f"{settings.media_base_url}/{image_path}"
+
+
+# Render an image as a URL, or inline as base64 for clients that opted in
+def render_image(image_path: Optional[str],
+                 inline_images: bool = False) -> Optional[str]:
+    if not image_path:
+        return None
+
+    if inline_images:
+        return encode_image_to_base64(image_path)
+
+    return image_url(image_path)
\ No newline at end of file
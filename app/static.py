@@ -0,0 +1,23 @@
+import os
+from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException
+from .config import settings
+
+
+# Static files served with long-lived cache headers. Every stored image
+# has a random name of its own (see schemas.image_url), so a changed image
+# always gets a new URL and the cached copy never goes stale. Raw uploads
+# waiting to be processed live in the same directories but aren't served:
+# they still carry their original metadata (e.g. EXIF locations).
+class CachedStaticFiles(StaticFiles):
+
+    async def get_response(self, path, scope):
+        if "_upload." in os.path.basename(path):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = (
+            f"public, max-age={settings.static_cache_max_age}, immutable")
+        return response
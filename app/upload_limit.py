@@ -0,0 +1,89 @@
+from fastapi import status
+from fastapi.responses import ORJSONResponse
+from .config import settings
+
+# Room for the multipart boundaries, part headers and the other form fields
+# sent along with the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+# Rejects request bodies above MAX_UPLOAD_SIZE on the upload routes before
+# the form is parsed. Starlette spools the whole multipart body to disk
+# before the endpoint runs, so a check in the endpoint only happens once the
+# client has sent everything. A too large Content-Length is answered right
+# away; bodies without one (chunked) are counted as they are received, and
+# the request is cut off with a 413 once the limit is passed, whatever the
+# form parser made of the interrupted body.
+class UploadLimitMiddleware:
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] != "POST"
+                or not scope["path"].startswith(self.paths)):
+            await self.app(scope, receive, send)
+            return
+
+        limit = settings.max_upload_size + MULTIPART_OVERHEAD
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    too_large = int(value) > limit
+                except ValueError:
+                    too_large = False
+                if too_large:
+                    await send_too_large(scope, receive, send)
+                    return
+                break
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLarge()
+            return message
+
+        # Once the limit is passed, whatever the app answers (usually a 400
+        # for the truncated form) is replaced by the 413
+        async def send_unless_exceeded(message):
+            nonlocal response_started
+            if exceeded:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, send_unless_exceeded)
+        except Exception:
+            # The app may let the error out as it is or wrapped in another
+            if not exceeded:
+                raise
+
+        if exceeded and not response_started:
+            await send_too_large(scope, receive, send)
+
+
+async def send_too_large(scope, receive, send):
+    response = ORJSONResponse(
+        {
+            "detail":
+            f"File too large, the limit is {settings.max_upload_size} bytes."
+        },
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        headers={"Connection": "close"})
+    await response(scope, receive, send)
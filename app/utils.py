@@ -1,7 +1,50 @@
 from passlib.context import CryptContext  # to encrypt the password which users enters
+from fastapi import HTTPException, Request, UploadFile, status
+from starlette.concurrency import run_in_threadpool
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from .config import settings
+from . import images
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import tempfile
+from typing import Optional
 
-# passlib's default algorithm
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# passlib's default algorithm. Pinning min and max rounds to the configured
+# cost makes hashes with any other cost "need update", so they get rehashed
+# on the next successful login.
+pwd_context = CryptContext(schemes=["bcrypt"],
+                           deprecated="auto",
+                           bcrypt__default_rounds=settings.bcrypt_rounds,
+                           bcrypt__min_rounds=settings.bcrypt_rounds,
+                           bcrypt__max_rounds=settings.bcrypt_rounds)
+
+# bcrypt takes hundreds of milliseconds per call, so it runs on its own
+# bounded pool instead of the event loop. The bound caps how many cores a
+# burst of logins can take away from request handling.
+_password_executor = None
+
+
+def get_password_executor() -> ThreadPoolExecutor:
+    global _password_executor
+    if _password_executor is None:
+        _password_executor = ThreadPoolExecutor(
+            max_workers=settings.password_hash_workers,
+            thread_name_prefix="password-hash")
+    return _password_executor
+
+
+def shutdown_password_executor():
+    global _password_executor
+    if _password_executor is not None:
+        _password_executor.shutdown(wait=True)
+        _password_executor = None
 
 
 # To Hash the password
@@ -12,3 +55,145 @@ def hash_password(password: str):
 # To verify and decrypt the password for login uses
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
+
+
+async def hash_password_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_password_executor(), hash_password,
+                                      password)
+
+
+# Returns (is_valid, new_hash); new_hash is set when the stored hash was made
+# with another cost and should be replaced
+async def verify_and_update_password(plain_password, hashed_password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_password_executor(),
+                                      pwd_context.verify_and_update,
+                                      plain_password, hashed_password)
+
+
+# Encode the sort key (updated_by or a score) and id of the last row of a
+# page into an opaque cursor
+def encode_cursor(sort_value, row_id: int) -> str:
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("utf-8")
+
+
+# Decode a cursor produced by encode_cursor, raises ValueError if malformed
+def decode_cursor(cursor: str, sort_type=datetime):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("utf-8"))
+        sort_value, row_id = json.loads(raw)
+        if sort_type is datetime:
+            sort_value = datetime.fromisoformat(sort_value)
+        else:
+            sort_value = sort_type(sort_value)
+        return sort_value, int(row_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+# Stream an uploaded file to destination in chunks. The data goes to a temp
+# file in the same directory which is renamed into place once complete, so
+# readers never see a partial image. Disk I/O runs in the threadpool to keep
+# the event loop free. Uploads above max_size are rejected with a 413.
+async def save_upload_file(upload: UploadFile,
+                           destination: str,
+                           max_size: int = None):
+    max_size = max_size or settings.max_upload_size
+
+    too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File too large, the limit is {max_size} bytes.")
+
+    # By now Starlette has spooled the whole form, UploadLimitMiddleware is
+    # what refuses oversized bodies before that. These checks are a second
+    # line of defence, e.g. for routes the middleware isn't configured for.
+    if upload.size is not None and upload.size > max_size:
+        raise too_large
+
+    directory = os.path.dirname(destination) or "."
+    fd, temp_path = await run_in_threadpool(tempfile.mkstemp,
+                                            dir=directory,
+                                            suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            written = 0
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > max_size:
+                    raise too_large
+                await run_in_threadpool(temp_file.write, chunk)
+
+        await run_in_threadpool(os.replace, temp_path, destination)
+
+    except BaseException:
+        await run_in_threadpool(_remove_if_exists, temp_path)
+        raise
+
+
+def _remove_if_exists(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# Reject a saved upload whose content isn't an image the pool can decode,
+# before the client is told it was accepted. The file is removed.
+async def check_image_upload(path: str):
+    image_format = await run_in_threadpool(images.sniff_image_format, path)
+
+    if image_format not in images.allowed_extensions():
+        await run_in_threadpool(_remove_if_exists, path)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid file format")
+
+
+# Weak ETag from everything the response body depends on
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+    return f'W/"{digest}"'
+
+
+# Headers letting clients revalidate instead of re-downloading. Without
+# last_modified (a body that can change without any timestamp moving) only
+# the ETag is sent.
+def conditional_headers(etag: str,
+                        last_modified: Optional[datetime] = None) -> dict:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(
+            last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+# True when the client's copy is current (If-None-Match takes precedence
+# over If-Modified-Since, as in RFC 9110). If-Modified-Since is ignored when
+# there is no last_modified.
+def is_not_modified(request: Request,
+                    etag: str,
+                    last_modified: Optional[datetime] = None) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison, the W/ prefix is ignored
+        client_etags = {
+            tag.strip().removeprefix("W/")
+            for tag in if_none_match.split(",")
+        }
+        return etag.removeprefix("W/") in client_etags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            client_time = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if client_time.tzinfo is None:
+            client_time = client_time.replace(tzinfo=timezone.utc)
+        # HTTP dates have a one second resolution
+        return last_modified.replace(microsecond=0) <= client_time
+
+    return False
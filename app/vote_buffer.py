@@ -0,0 +1,135 @@
+import asyncio
+from . import databases, votes_service
+from .config import settings
+
+
+# Write-behind buffer for votes, enabled with VOTE_WRITE_BEHIND=true.
+# post_vote and batch_vote only record the latest direction per
+# (user_id, post_id) here,
+# and a background task writes the pending votes in one transaction every
+# vote_flush_interval seconds, or as soon as vote_flush_size votes are
+# pending.
+#
+# Durability: accepted votes live only in this worker's memory until they
+# are flushed, so a crash loses at most vote_flush_interval seconds (or
+# vote_flush_size votes) of votes per worker. A clean shutdown flushes
+# everything that is pending. Votes for posts or users deleted before the
+# flush are counted in `skipped`. When the database rejects a batch, its
+# votes are retried one per transaction, so only the votes that fail on
+# their own are dropped, counted in `failed` and logged. Votes and vote
+# counts read back from the database lag by up to one flush interval.
+class VoteBuffer:
+
+    def __init__(self, flush_interval: float, flush_size: int):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        # Votes accepted, and votes that replaced a pending vote for the
+        # same user and post (so were never written on their own)
+        self.accepted = 0
+        self.coalesced = 0
+        # Flushes run, vote rows inserted or deleted, votes whose post or
+        # user was deleted, votes dropped because writing them failed
+        self.flushes = 0
+        self.written = 0
+        self.skipped = 0
+        self.failed = 0
+        self._pending = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    def add(self, user_id: int, post_id: int, dir: int):
+        key = (user_id, post_id)
+        if key in self._pending:
+            self.coalesced += 1
+        self._pending[key] = dir
+        self.accepted += 1
+
+        if len(self._pending) >= self.flush_size:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # Stops the background task once it has flushed whatever is pending.
+    # The task isn't cancelled, that could drop a batch mid-flush.
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),
+                                       timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        self.flushes += 1
+
+        try:
+            self._count(await self._write(pending))
+            return
+        except Exception as e:
+            print(f'Vote buffer flush failed, retrying votes one by one: '
+                  f'{str(e)}')
+
+        for key, dir in pending.items():
+            try:
+                self._count(await self._write({key: dir}))
+            except Exception as e:
+                self.failed += 1
+                print(f'Vote buffer dropped vote {key} dir={dir}: {str(e)}')
+
+    async def _write(self, votes: dict) -> dict:
+        async with databases.AsyncSessionLocal() as db:
+            results = await votes_service.apply_votes(db, votes)
+            await db.commit()
+        return results
+
+    def _count(self, results: dict):
+        for result in results.values():
+            if result in ("voted", "deleted"):
+                self.written += 1
+            elif result in ("post_not_found", "user_not_found"):
+                self.skipped += 1
+
+    def stats(self) -> dict:
+        return dict(pending=len(self._pending),
+                    accepted=self.accepted,
+                    coalesced=self.coalesced,
+                    flushes=self.flushes,
+                    written=self.written,
+                    skipped=self.skipped,
+                    failed=self.failed)
+
+
+# Created by the app lifespan when write-behind is enabled
+vote_buffer = None
+
+
+def start_vote_buffer():
+    global vote_buffer
+    if settings.vote_write_behind and vote_buffer is None:
+        vote_buffer = VoteBuffer(flush_interval=settings.vote_flush_interval,
+                                 flush_size=settings.vote_flush_size)
+        vote_buffer.start()
+
+
+async def stop_vote_buffer():
+    global vote_buffer
+    if vote_buffer is not None:
+        await vote_buffer.stop()
+        vote_buffer = None
@@ -0,0 +1,101 @@
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+from sqlalchemy import select, update, delete, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, ranking
+
+
+# Adjust the denormalized counter in the same transaction as the vote row.
+# The increment is done in SQL so concurrent voters don't overwrite each other.
+# The hot score is refreshed in the same statement; SET expressions see the
+# old row, hence the delta is applied in both.
+async def update_vote_count(db: AsyncSession, post_ids: List[int],
+                            delta: int):
+    await db.execute(
+        update(models.Post).where(models.Post.post_id.in_(post_ids)).values(
+            vote_count=models.Post.vote_count + delta,
+            hot_score=ranking.hot_score(models.Post.vote_count + delta,
+                                        models.Post.created_at)).
+        execution_options(synchronize_session=False))
+
+
+# Write {(user_id, post_id): dir} with one INSERT ... ON CONFLICT DO NOTHING
+# and one DELETE ... RETURNING, and adjust the vote counters of the affected
+# posts, without committing. Votes for posts or users that no longer exist
+# are skipped instead of failing the whole statement on a foreign key.
+# Returns the outcome of every vote: voted, already_voted, deleted,
+# not_voted, post_not_found or user_not_found.
+async def apply_votes(
+        db: AsyncSession,
+        votes: Dict[Tuple[int, int], int]) -> Dict[Tuple[int, int], str]:
+    post_ids = {post_id for _, post_id in votes}
+    user_ids = {user_id for user_id, _ in votes}
+    existing_post_ids = set((await db.scalars(
+        select(models.Post.post_id).where(
+            models.Post.post_id.in_(post_ids)))).all())
+    existing_user_ids = set((await db.scalars(
+        select(models.Users.id).where(models.Users.id.in_(user_ids)))).all())
+
+    results = {}
+    upvotes = []
+    unvotes = []
+    for key, dir in votes.items():
+        user_id, post_id = key
+        if post_id not in existing_post_ids:
+            results[key] = "post_not_found"
+        elif user_id not in existing_user_ids:
+            results[key] = "user_not_found"
+        elif dir == 1:
+            upvotes.append(key)
+        else:
+            unvotes.append(key)
+
+    deltas = Counter()
+
+    if upvotes:
+        inserted = set(map(tuple, (await db.execute(
+            insert(models.Votes).values([{
+                "user_id": user_id,
+                "post_id": post_id
+            } for user_id, post_id in upvotes]).on_conflict_do_nothing(
+            ).returning(models.Votes.user_id, models.Votes.post_id))).all()))
+        for key in upvotes:
+            results[key] = "voted" if key in inserted else "already_voted"
+        deltas.update(post_id for _, post_id in inserted)
+
+    if unvotes:
+        deleted = set(map(tuple, (await db.execute(
+            delete(models.Votes).where(
+                tuple_(models.Votes.user_id,
+                       models.Votes.post_id).in_(unvotes)).returning(
+                           models.Votes.user_id, models.Votes.post_id))).all()))
+        for key in unvotes:
+            results[key] = "deleted" if key in deleted else "not_voted"
+        deltas.subtract(post_id for _, post_id in deleted)
+
+    await apply_vote_deltas(db, deltas)
+
+    return results
+
+
+# Adjust the counters of many posts by {post_id: delta}, with one update per
+# distinct delta
+async def apply_vote_deltas(db: AsyncSession, deltas: Dict[int, int]):
+    post_ids_by_delta = defaultdict(list)
+    for post_id, delta in deltas.items():
+        if delta:
+            post_ids_by_delta[delta].append(post_id)
+
+    for delta, delta_post_ids in post_ids_by_delta.items():
+        await update_vote_count(db, delta_post_ids, delta)
+
+
+# Remove every vote of a user and take them off the posts' counters, without
+# committing. Run before deleting the user, whose votes would otherwise be
+# removed by the foreign key cascade with the counters left as they were.
+async def delete_user_votes(db: AsyncSession, user_id: int):
+    post_ids = (await db.scalars(
+        delete(models.Votes).where(models.Votes.user_id == user_id).returning(
+            models.Votes.post_id))).all()
+    await apply_vote_deltas(db, {post_id: -1 for post_id in post_ids})
@@ -0,0 +1,54 @@
+"""Compare two load_suite.py result files endpoint by endpoint.
+
+    python benchmarks/compare.py benchmarks/results/abc1234.json \
+        benchmarks/results/def5678.json
+
+Prints the old and new value and the relative change of the p50/p95/p99
+latency and the throughput of every endpoint present in both runs.
+"""
+import argparse
+import json
+
+METRICS = (("p50", "latency_ms"), ("p95", "latency_ms"),
+           ("p99", "latency_ms"), ("throughput_rps", None))
+
+
+def value(result, name, group):
+    if group is None:
+        return result.get(name)
+    return result.get(group, {}).get(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("old")
+    parser.add_argument("new")
+    args = parser.parse_args()
+
+    with open(args.old) as old_file, open(args.new) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    for name, new_result in new["scenarios"].items():
+        old_result = old["scenarios"].get(name)
+        if old_result is None:
+            continue
+
+        changes = []
+        for metric, group in METRICS:
+            before = value(old_result, metric, group)
+            after = value(new_result, metric, group)
+            if not before or after is None:
+                continue
+            changes.append(f"{metric} {before:.1f} -> {after:.1f} "
+                           f"({(after - before) / before * 100:+.1f}%)")
+        print(f"{name:>24}: {', '.join(changes)}")
+
+    for key in ("server_peak_rss_bytes", "driver_peak_rss_bytes"):
+        if old.get(key) and new.get(key):
+            print(f"{key}: {old[key] / 2**20:.1f} MiB -> "
+                  f"{new[key] / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Measure throughput of an endpoint under concurrent load.
+
+Run it against a live server, once on the old build and once on the new
+one, and compare the requests/second:
+
+    uvicorn app.main:app --workers 1
+    python benchmarks/concurrent_requests.py --token <jwt> \
+        --path /post/get_all_post --concurrency 50 --requests 2000
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+
+async def worker(client, send, queue, latencies):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+
+        start = time.perf_counter()
+        response = await send(client)
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+
+
+# Call send(client) `requests` times with `concurrency` calls in flight,
+# returns the elapsed time and the sorted latencies
+async def run_load(base_url, concurrency, requests, send):
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(None)
+
+    latencies = []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits,
+                                 timeout=60) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            worker(client, send, queue, latencies)
+            for _ in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return elapsed, latencies
+
+
+def report(requests, concurrency, elapsed, latencies):
+    print(f"{requests} requests, concurrency {concurrency}")
+    print(f"throughput: {requests / elapsed:.1f} req/s")
+    print(f"p50: {latencies[len(latencies) // 2] * 1000:.1f} ms")
+    print(f"p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+
+
+async def run(args):
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+
+    async def send(client):
+        return await client.get(args.path, headers=headers)
+
+    elapsed, latencies = await run_load(args.base_url, args.concurrency,
+                                        args.requests, send)
+    report(args.requests, args.concurrency, elapsed, latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", default="/post/get_all_post")
+    parser.add_argument("--token", default=None)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,483 @@
+"""Load test every API endpoint and write the results as JSON.
+
+Run benchmarks/seed.py first. By default the suite starts its own server
+(uvicorn, one worker) on a free port so the peak RSS of the server can be
+measured, then calls each endpoint in turn with --concurrency requests in
+flight. Requests that need setup (a token, a post to update, a user to
+delete) get it before their endpoint is timed. Writes only touch rows the
+run created itself (registered users, created posts, votes on those posts),
+so the seeded data is the same for every run. Run from the repository
+root, with the database configured in .env:
+
+    python benchmarks/load_suite.py --concurrency 50 \
+        --requests 2000
+
+Every endpoint reports p50/p95/p99 latency, throughput, response status
+counts and the server's peak RSS so far. Results go to
+benchmarks/results/<commit>.json; compare two runs with
+benchmarks/compare.py. Pass --base-url to use a server that is already
+running (peak RSS is then only reported with --server-pid).
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+
+# One endpoint under load: items() returns one item per request (untimed
+# setup goes there, it may be a coroutine), send(client, item) makes the
+# request, and on_success(item, response) keeps what later scenarios need
+class Scenario:
+
+    def __init__(self, name, send, items, on_success=None):
+        self.name = name
+        self.send = send
+        self.items = items
+        self.on_success = on_success
+
+
+def percentile(sorted_values, fraction):
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+# Peak RSS of a process and its children (the image workers), from /proc
+def peak_rss_bytes(pid):
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as status_file:
+                for line in status_file:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1]) * 1024
+            with open(f"/proc/{current}/task/{current}/children") as children:
+                pids.extend(int(child) for child in children.read().split())
+        except OSError:
+            continue
+    return total
+
+
+async def run_scenario(client, scenario, items, concurrency):
+    queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+
+    latencies = []
+    statuses = Counter()
+    responses = []
+
+    async def worker():
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            start = time.perf_counter()
+            try:
+                response = await scenario.send(client, item)
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            statuses[str(response.status_code)] += 1
+            responses.append((item, response))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items()
+                 if not status.startswith("2"))
+    result = dict(requests=len(items),
+                  errors=errors,
+                  statuses=dict(statuses),
+                  elapsed_s=elapsed,
+                  throughput_rps=len(items) / elapsed if elapsed else 0.0)
+    if latencies:
+        result["latency_ms"] = dict(
+            p50=percentile(latencies, 0.50) * 1000,
+            p95=percentile(latencies, 0.95) * 1000,
+            p99=percentile(latencies, 0.99) * 1000,
+            mean=sum(latencies) / len(latencies) * 1000,
+            max=latencies[-1] * 1000)
+
+    return result, responses
+
+
+def sample_jpeg():
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.linear_gradient("L").resize((1200, 900)).convert("RGB").save(
+        buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+# The scenarios in the order they run; later ones use what earlier ones
+# created (users to update and delete, posts to update, vote on and delete)
+def build_scenarios(args, manifest, rng, client, sessions):
+    run_id = uuid.uuid4().hex[:8]
+    image = sample_jpeg()
+    created_posts = []
+    registered_users = []
+    registered = []
+    votes_up = []
+
+    def auth(session):
+        return {"Authorization": f"Bearer {session['token']}"}
+
+    def any_session():
+        return rng.choice(sessions)
+
+    def random_user_id():
+        return rng.randint(1, manifest["users"])
+
+    def random_post_id():
+        return rng.randint(1, manifest["posts"])
+
+    def repeat(n, make_item=lambda: None):
+        return lambda: [make_item() for _ in range(n)]
+
+    async def login(client, user_id):
+        return await client.post("/auth/login",
+                                 data={
+                                     "username": f"user{user_id}@example.com",
+                                     "password": manifest["password"]
+                                 })
+
+    async def register(client, index):
+        email = f"load-{run_id}-{index}@example.com"
+        return await client.post("/auth/register",
+                                 json={
+                                     "first_name": "Load",
+                                     "last_name": "Test",
+                                     "phone": f"+9{run_id}{index}",
+                                     "email": email,
+                                     "password": manifest["password"]
+                                 })
+
+    async def update_user(client, session):
+        return await client.put(f"/auth/update_user/{session['user_id']}",
+                                headers=auth(session),
+                                json={
+                                    "first_name": "Load",
+                                    "last_name": "Test",
+                                    "phone": session["phone"],
+                                    "email": session["email"]
+                                })
+
+    async def create_post(client, session):
+        return await client.post("/post/create_post",
+                                 headers=auth(session),
+                                 data={"caption": f"Load test {run_id}"},
+                                 files={"image": ("load.jpg", image,
+                                                  "image/jpeg")})
+
+    # Log in the users registered by the register scenario once, untimed
+    async def registered_sessions():
+        if not registered:
+            for user in registered_users:
+                response = await client.post("/auth/login",
+                                             data={
+                                                 "username": user["email"],
+                                                 "password":
+                                                 manifest["password"]
+                                             })
+                response.raise_for_status()
+                registered.append({
+                    "user_id": user["id"],
+                    "email": user["email"],
+                    "phone": user["phone"],
+                    "token": response.json()["access_token"]
+                })
+        return list(registered)
+
+    # n requests spread over the registered users, none if the register
+    # scenario didn't run
+    def registered_items(n):
+
+        async def items():
+            sessions = await registered_sessions()
+            return [rng.choice(sessions)
+                    for _ in range(n)] if sessions else []
+
+        return items
+
+    # A batch of distinct created posts with random directions
+    def created_posts_batch():
+        post_ids = [post_id for _, post_id in created_posts]
+        return [{
+            "post_id": post_id,
+            "dir": rng.randint(0, 1)
+        } for post_id in rng.sample(post_ids,
+                                    min(args.batch_size, len(post_ids)))]
+
+    n = args.requests
+    # Requests hashing a password are far slower, they get fewer
+    n_bcrypt = args.bcrypt_requests
+
+    return [
+        Scenario("root", lambda client, _: client.get("/"), repeat(n)),
+        Scenario("login", login, repeat(n_bcrypt, random_user_id)),
+        Scenario(
+            "register", register, lambda: list(range(n_bcrypt)),
+            lambda _, response: registered_users.append(response.json()[
+                "user_detail"])),
+        Scenario(
+            "get_all_users", lambda client, session: client.get(
+                "/auth/get_all_users", params={"limit": 20},
+                headers=auth(session)), repeat(n, any_session)),
+        Scenario(
+            "get_user", lambda client, item: client.get(
+                f"/auth/get_user/{item[1]}", headers=auth(item[0])),
+            repeat(n, lambda: (any_session(), random_user_id()))),
+        Scenario(
+            "get_profile_picture_url", lambda client, session: client.get(
+                f"/auth/get_profile_picture_url/{session['user_id']}",
+                headers=auth(session)), repeat(n, any_session)),
+        Scenario("update_user", update_user, registered_items(n)),
+        Scenario(
+            "update_password", lambda client, session: client.put(
+                f"/auth/update_password/{session['user_id']}",
+                headers=auth(session),
+                json={"password": manifest["password"]}),
+            registered_items(n_bcrypt)),
+        Scenario(
+            "upload_profile_pic", lambda client, session: client.post(
+                f"/auth/upload_profile_pic/{session['user_id']}",
+                headers=auth(session),
+                files={"profile_pic": ("load.jpg", image, "image/jpeg")}),
+            registered_items(n)),
+        Scenario(
+            "create_post", create_post, repeat(n, any_session),
+            lambda session, response: created_posts.append(
+                (session, response.json()["post_detail"]["post_id"]))),
+        Scenario(
+            "get_all_post", lambda client, session: client.get(
+                "/post/get_all_post", params={"limit": 20},
+                headers=auth(session)), repeat(n, any_session)),
+        Scenario(
+            "feed", lambda client, session: client.get(
+                "/post/feed", params={"limit": 20}, headers=auth(session)),
+            repeat(n, any_session)),
+        Scenario(
+            "get_post", lambda client, item: client.get(
+                f"/post/get_post/{item[1]}", headers=auth(item[0])),
+            repeat(n, lambda: (any_session(), random_post_id()))),
+        Scenario(
+            "update_post", lambda client, item: client.put(
+                f"/post/update_post/{item[1]}",
+                headers=auth(item[0]),
+                json={"caption": f"Updated {run_id}", "is_published": True}),
+            lambda: list(created_posts)),
+        # Every session votes on a distinct created post, then takes the
+        # vote back
+        Scenario(
+            "post_vote_up", lambda client, item: client.post(
+                "/vote/post_vote", headers=auth(item[0]),
+                json={"post_id": item[1], "dir": 1}),
+            lambda: [(any_session(), post_id)
+                     for _, post_id in created_posts],
+            lambda item, _: votes_up.append(item)),
+        Scenario(
+            "post_vote_down", lambda client, item: client.post(
+                "/vote/post_vote", headers=auth(item[0]),
+                json={"post_id": item[1], "dir": 0}),
+            lambda: list(votes_up)),
+        Scenario(
+            "batch_vote", lambda client, item: client.post(
+                "/vote/batch", headers=auth(item[0]), json=item[1]),
+            lambda: [(any_session(), created_posts_batch())
+                     for _ in range(n)] if created_posts else []),
+        Scenario(
+            "delete_post", lambda client, item: client.delete(
+                f"/post/delete_post/{item[1]}", headers=auth(item[0])),
+            lambda: list(created_posts)),
+        Scenario(
+            "delete_user", lambda client, session: client.delete(
+                f"/auth/delete_user/{session['user_id']}",
+                headers=auth(session)), registered_sessions),
+        Scenario("pool_stats",
+                 lambda client, session: client.get(
+                     "/monitoring/pool_stats", headers=auth(session)),
+                 repeat(n, any_session)),
+        Scenario("cache_stats",
+                 lambda client, session: client.get(
+                     "/monitoring/cache_stats", headers=auth(session)),
+                 repeat(n, any_session)),
+        Scenario("vote_buffer_stats",
+                 lambda client, session: client.get(
+                     "/monitoring/vote_buffer_stats", headers=auth(session)),
+                 repeat(n, any_session)),
+        Scenario("metrics", lambda client, _: client.get("/metrics"),
+                 repeat(n)),
+    ]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while True:
+            try:
+                (await client.get("/")).raise_for_status()
+                return
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.5)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              check=True,
+                              capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args, server_pid):
+    with open(args.manifest) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.base_url,
+                                 limits=limits,
+                                 timeout=120) as client:
+        # One logged in seeded user per concurrent request, so writes don't
+        # all contend on the same rows
+        sessions = []
+        for user_id in range(1, args.concurrency + 1):
+            response = await client.post("/auth/login",
+                                         data={
+                                             "username":
+                                             f"user{user_id}@example.com",
+                                             "password": manifest["password"]
+                                         })
+            response.raise_for_status()
+            sessions.append({
+                "user_id": user_id,
+                "token": response.json()["access_token"]
+            })
+
+        results = {}
+        for scenario in build_scenarios(args, manifest, rng, client,
+                                        sessions):
+            if args.only and scenario.name not in args.only:
+                continue
+
+            items = scenario.items()
+            if asyncio.iscoroutine(items):
+                items = await items
+
+            result, responses = await run_scenario(client, scenario, items,
+                                                   args.concurrency)
+
+            if scenario.on_success is not None:
+                for item, response in responses:
+                    if response.is_success:
+                        scenario.on_success(item, response)
+
+            if server_pid:
+                result["server_peak_rss_bytes"] = peak_rss_bytes(server_pid)
+            results[scenario.name] = result
+
+            latency = result.get("latency_ms", {})
+            print(f"{scenario.name:>24}: {result['requests']:>6} requests, "
+                  f"{result['errors']:>4} errors, "
+                  f"{result['throughput_rps']:8.1f} req/s, "
+                  f"p50 {latency.get('p50', 0):7.1f} ms, "
+                  f"p95 {latency.get('p95', 0):7.1f} ms, "
+                  f"p99 {latency.get('p99', 0):7.1f} ms")
+
+    return dict(commit=git_commit(),
+                started_at=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                concurrency=args.concurrency,
+                requests=args.requests,
+                bcrypt_requests=args.bcrypt_requests,
+                seed_manifest=dict(users=manifest["users"],
+                                   posts=manifest["posts"],
+                                   votes=manifest["votes"]),
+                scenarios=results,
+                server_peak_rss_bytes=(peak_rss_bytes(server_pid)
+                                       if server_pid else None),
+                driver_peak_rss_bytes=resource.getrusage(
+                    resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url",
+                        help="use a running server instead of starting one")
+    parser.add_argument("--server-pid", type=int)
+    parser.add_argument("--manifest",
+                        default="benchmarks/results/seed_manifest.json")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--bcrypt-requests", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only",
+                        nargs="*",
+                        help="scenario names, default is all of them; "
+                        "scenarios writing to users or posts only use the "
+                        "ones created by register and create_post")
+    parser.add_argument("--output",
+                        help="default is benchmarks/results/<commit>.json")
+    args = parser.parse_args()
+
+    server = None
+    server_pid = args.server_pid
+    if args.base_url is None:
+        port = free_port()
+        args.base_url = f"http://127.0.0.1:{port}"
+        server = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "app.main:app", "--port",
+            str(port), "--workers", "1", "--log-level", "warning"
+        ])
+        server_pid = server.pid
+
+    try:
+        if server is not None:
+            asyncio.run(wait_until_up(args.base_url))
+        results = asyncio.run(run(args, server_pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    output = args.output or os.path.join(
+        "benchmarks", "results", f"{results['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Measure /auth/login throughput under concurrent load.
+
+Logins are dominated by bcrypt, so this shows how many logins a worker
+sustains and whether other requests stall meanwhile (compare the p99 of
+concurrent_requests.py run at the same time):
+
+    python benchmarks/login_throughput.py --email user@example.com \
+        --password secret --concurrency 20 --requests 200
+"""
+import argparse
+import asyncio
+
+from concurrent_requests import run_load, report
+
+
+async def run(args):
+    credentials = {"username": args.email, "password": args.password}
+
+    async def send(client):
+        return await client.post("/auth/login", data=credentials)
+
+    elapsed, latencies = await run_load(args.base_url, args.concurrency,
+                                        args.requests, send)
+    report(args.requests, args.concurrency, elapsed, latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
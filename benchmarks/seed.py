@@ -0,0 +1,196 @@
+"""Fill the database with synthetic users, posts, votes and images.
+
+Rows are generated from a fixed random seed, so two runs with the same
+arguments produce the same data, and streamed into PostgreSQL with COPY.
+Every user has the same password (hashed once, with the configured bcrypt
+cost) so load tests can log in as anyone. The tables must be empty, or
+pass --truncate to empty them first. Run from the repository root, with
+the database configured in .env:
+
+    python benchmarks/seed.py --truncate \
+        --users 100000 --posts 1000000 --votes 10000000
+
+A manifest describing the data (sizes, password, image paths) is written
+to --manifest for benchmarks/load_suite.py.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import images, ranking, utils  # noqa: E402
+from app.cli import copy_rows, fix_sequences  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.databases import engine  # noqa: E402
+from app.routers.auth import profile_pictures_directory  # noqa: E402
+from app.routers.posts import post_images_directory  # noqa: E402
+
+PASSWORD = "seed-password"
+
+# Newest post time, fixed so the data doesn't depend on when it was seeded
+SEED_NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+# Random shapes on a gradient, so every sample has a different size on disk
+def make_sample_images(rng, directory, prefix, count):
+    from PIL import Image, ImageDraw
+
+    os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    for index in range(count):
+        img = Image.linear_gradient("L").resize((1600, 1200)).convert("RGB")
+        draw = ImageDraw.Draw(img)
+        for _ in range(40):
+            x, y = rng.randrange(1600), rng.randrange(1200)
+            size = rng.randrange(20, 400)
+            color = tuple(rng.randrange(256) for _ in range(3))
+            draw.ellipse((x, y, x + size, y + size), fill=color)
+
+        output_base = os.path.join(directory, f"seed_{prefix}_{index}")
+        upload_path = f"{output_base}_upload.jpg"
+        img.save(upload_path, "JPEG", quality=90)
+
+        renditions = images.process_image(upload_path, output_base,
+                                          settings.image_format.upper())
+        paths.append(renditions["full"])
+
+    return paths
+
+
+def generate_users(args, password_hash, profile_pictures):
+    now = SEED_NOW.isoformat()
+    for user_id in range(1, args.users + 1):
+        yield (user_id, f"User{user_id}", "Seed", f"+1{user_id:010d}",
+               f"user{user_id}@example.com", password_hash,
+               profile_pictures[user_id % len(profile_pictures)], now)
+
+
+# Roughly exponential votes per post averaging votes / posts, so a few
+# posts get far more votes than the rest
+def generate_vote_counts(rng, args):
+    mean = args.votes / args.posts
+    return [
+        min(args.users, int(rng.expovariate(1 / mean))) if mean else 0
+        for _ in range(args.posts)
+    ]
+
+
+def generate_posts(rng, args, vote_counts, post_images):
+    span = timedelta(days=args.days).total_seconds()
+    for index, vote_count in enumerate(vote_counts):
+        post_id = index + 1
+        created_at = SEED_NOW - timedelta(seconds=rng.uniform(0, span))
+        # Same formula as ranking.hot_score; log is base 10 in PostgreSQL
+        hot_score = (math.log10(max(vote_count, 1)) +
+                     created_at.timestamp() / ranking.HOT_DECAY_SECONDS)
+        yield (post_id, rng.randint(1, args.users), f"Seed post {post_id}",
+               post_images[post_id % len(post_images)], True, True,
+               vote_count, hot_score, created_at.isoformat(),
+               created_at.isoformat())
+
+
+def generate_votes(rng, args, vote_counts):
+    for index, vote_count in enumerate(vote_counts):
+        for user_id in rng.sample(range(1, args.users + 1), vote_count):
+            yield (user_id, index + 1)
+
+
+def seed(args):
+    rng = random.Random(args.seed)
+
+    started = time.perf_counter()
+    profile_pictures = make_sample_images(rng, profile_pictures_directory,
+                                          "profile", args.images)
+    post_images = make_sample_images(rng, post_images_directory, "post",
+                                     args.images)
+    print(f"{2 * args.images} sample images in "
+          f"{time.perf_counter() - started:.1f} s")
+
+    password_hash = utils.hash_password(PASSWORD)
+    vote_counts = generate_vote_counts(rng, args)
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+
+        if args.truncate:
+            cursor.execute("TRUNCATE users, posts, votes RESTART IDENTITY")
+        else:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM users)")
+            if cursor.fetchone()[0]:
+                raise SystemExit("The users table isn't empty, pass "
+                                 "--truncate to replace its contents.")
+
+        tables = (
+            ("users", ("id", "first_name", "last_name", "phone", "email",
+                       "password", "profile_pic", "updated_by"),
+             generate_users(args, password_hash, profile_pictures)),
+            ("posts", ("post_id", "user_id", "caption", "post_image",
+                       "is_published", "is_ready", "vote_count", "hot_score",
+                       "created_at", "updated_by"),
+             generate_posts(rng, args, vote_counts, post_images)),
+            ("votes", ("user_id", "post_id"),
+             generate_votes(rng, args, vote_counts)),
+        )
+        for table, columns, rows in tables:
+            started = time.perf_counter()
+            count = copy_rows(cursor, table, columns, rows)
+            print(f"{table}: {count} rows in "
+                  f"{time.perf_counter() - started:.1f} s")
+
+        # Ids were given explicitly, move the sequences past them
+        fix_sequences(cursor)
+
+        connection.commit()
+
+        cursor.execute("ANALYZE users, posts, votes")
+        connection.commit()
+    finally:
+        connection.close()
+
+    manifest = dict(seed=args.seed,
+                    users=args.users,
+                    posts=args.posts,
+                    votes=sum(vote_counts),
+                    password=PASSWORD,
+                    post_images=post_images,
+                    profile_pictures=profile_pictures)
+
+    os.makedirs(os.path.dirname(args.manifest) or ".", exist_ok=True)
+    with open(args.manifest, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    print(f"Manifest written to {args.manifest}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--posts", type=int, default=1000000)
+    parser.add_argument("--votes",
+                        type=int,
+                        default=10000000,
+                        help="approximate, votes per post are random")
+    parser.add_argument("--images",
+                        type=int,
+                        default=20,
+                        help="distinct sample images of each kind")
+    parser.add_argument("--days",
+                        type=int,
+                        default=30,
+                        help="posts are spread over this many days")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--truncate", action="store_true")
+    parser.add_argument("--manifest",
+                        default="benchmarks/results/seed_manifest.json")
+    seed(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
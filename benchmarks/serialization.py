@@ -0,0 +1,147 @@
+"""Serialization microbenchmark for the large list responses.
+
+Builds synthetic GetPostsResponse and UserListResponse payloads of 1k and
+10k items and compares, for each, the time and peak allocations of
+FastAPI's own serialization (fastapi.routing.serialize_response) followed
+by the response class's render():
+
+- no response_model + JSONResponse: jsonable_encoder, then json.dumps
+- the route's response_model + ORJSONResponse: what GET /post/get_all_post
+  and GET /auth/get_all_users do now. The returned model is dumped,
+  validated again against the route's response field and serialized
+  before orjson runs.
+
+    python benchmarks/serialization.py --repeat 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Settings are required at import, the values don't matter here (the
+# engines don't connect until used, but the port must be a number)
+for name in ("database_hostname", "database_password", "database_name",
+             "database_username", "secret_key", "algorithm"):
+    os.environ.setdefault(name.upper(), "benchmark")
+os.environ.setdefault("DATABASE_PORT", "5432")
+
+from app import schemas  # noqa: E402
+from app.main import app  # noqa: E402
+
+SIZES = (1000, 10000)
+
+
+def make_user(user_id):
+    return schemas.UserDetail(
+        id=user_id,
+        first_name=f"First{user_id}",
+        last_name=f"Last{user_id}",
+        phone=f"+1555{user_id:07d}",
+        email=f"user{user_id}@example.com",
+        profile_pic=(f"/profile_pictures/{user_id:032x}_{user_id}"
+                     "_profile_full.jpg"),
+        updated_by=datetime.now(timezone.utc))
+
+
+def make_posts_response(size):
+    posts = [
+        schemas.PostResponseBase(
+            post_id=post_id,
+            user_id=post_id % 1000,
+            caption=f"Caption of post {post_id}",
+            is_published=True,
+            post_image=f"/posts_images/{post_id:032x}_1_post_full.jpg",
+            post_image_renditions={
+                name: f"/posts_images/{post_id:032x}_1_post_{name}.jpg"
+                for name in ("thumbnail", "feed", "full")
+            },
+            updated_by=datetime.now(timezone.utc),
+            user_detail=make_user(post_id % 1000),
+            votes=post_id % 97) for post_id in range(size)
+    ]
+    return schemas.GetPostsResponse(message="All posts fetched successfully.",
+                                    total_posts=size,
+                                    post_details=posts)
+
+
+def make_users_response(size):
+    users = [make_user(user_id) for user_id in range(size)]
+    return schemas.UserListResponse(
+        message="All users data Fetched Successfully.",
+        total_users_count=size,
+        users_list=users)
+
+
+def response_field(path):
+    return next(route.response_field for route in app.routes
+                if getattr(route, "path", None) == path)
+
+
+async def default_encoder(response, field):
+    content = await serialize_response(response_content=response)
+    return JSONResponse(content).body
+
+
+async def route_encoder(response, field):
+    content = await serialize_response(field=field,
+                                       response_content=response)
+    return ORJSONResponse(content).body
+
+
+ENCODERS = {
+    "no model+json": default_encoder,
+    "response_model+orjson": route_encoder,
+}
+
+
+async def measure(encoder, response, field, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await encoder(response, field)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    body = await encoder(response, field)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak, len(body)
+
+
+async def run(args):
+    payloads = (
+        ("posts", make_posts_response, response_field("/post/get_all_post")),
+        ("users", make_users_response,
+         response_field("/auth/get_all_users")),
+    )
+
+    print(f"{'payload':<24}{'encoder':<24}{'best ms':>10}"
+          f"{'peak KiB':>12}{'body KiB':>12}")
+    for size in SIZES:
+        for label, factory, field in payloads:
+            response = factory(size)
+            for name, encoder in ENCODERS.items():
+                best, peak, body = await measure(encoder, response, field,
+                                                 args.repeat)
+                print(f"{f'{label} x{size}':<24}{name:<24}"
+                      f"{best * 1000:>10.1f}{peak / 1024:>12.0f}"
+                      f"{body / 1024:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
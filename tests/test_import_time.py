@@ -0,0 +1,48 @@
+"""Importing the app stays within a time budget.
+
+Importing app.main must not connect to the database or do other startup
+work (that belongs in main.lifespan). Each run uses a fresh interpreter
+with placeholder settings, so no database is needed; the best run is
+compared to the budget.
+"""
+import os
+import subprocess
+import sys
+
+BUDGET_SECONDS = 1.5
+RUNS = 5
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = ("import time; start = time.perf_counter(); import app.main; "
+           "print(time.perf_counter() - start)")
+
+# Required settings; the engines are created but never connect
+PLACEHOLDER_SETTINGS = {
+    "DATABASE_HOSTNAME": "localhost",
+    "DATABASE_PORT": "5432",
+    "DATABASE_PASSWORD": "import-time",
+    "DATABASE_NAME": "import-time",
+    "DATABASE_USERNAME": "import-time",
+    "SECRET_KEY": "import-time",
+    "ALGORITHM": "HS256",
+}
+
+
+def test_import_time():
+    env = dict(os.environ, **PLACEHOLDER_SETTINGS)
+
+    timings = []
+    for _ in range(RUNS):
+        output = subprocess.run([sys.executable, "-c", MEASURE],
+                                check=True,
+                                capture_output=True,
+                                text=True,
+                                cwd=REPOSITORY,
+                                env=env).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+
+    best = min(timings)
+    assert best <= BUDGET_SECONDS, (
+        f"import app.main took {best * 1000:.0f} ms at best, budget "
+        f"{BUDGET_SECONDS * 1000:.0f} ms")
@@ -0,0 +1,92 @@
+"""SQL statement budgets of the read endpoints.
+
+Each endpoint is called in-process through app.query_counter's
+assert_max_queries, so an N+1 load fails the test. Runs against the
+database configured in .env (schema at alembic head) and is skipped when
+there is none. A user and a post are created for the run and removed
+afterwards.
+"""
+import asyncio
+import uuid
+
+import httpx
+import pytest
+
+try:
+    from app.config import settings  # noqa: F401
+except Exception:  # required settings missing
+    pytest.skip("no database configured", allow_module_level=True)
+
+from sqlalchemy import delete  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from app import databases, models, oauth2  # noqa: E402
+from app.main import app  # noqa: E402
+from app.query_counter import assert_max_queries  # noqa: E402
+
+# Path and statement budget; each includes one statement for the
+# authenticated user lookup when it isn't cached yet
+BUDGETS = [
+    ("/post/get_all_post?limit=100", 2),
+    ("/post/feed?limit=100", 2),
+    ("/post/get_post/{post_id}", 2),
+    ("/auth/get_all_users?limit=100", 2),
+    ("/auth/get_user/{user_id}", 2),
+]
+
+
+@pytest.fixture(scope="module")
+def author():
+    run_id = uuid.uuid4().hex
+    db = databases.SessionLocal()
+    try:
+        user = models.Users(first_name="Query",
+                            last_name="Count",
+                            phone=f"+0{run_id[:12]}",
+                            email=f"query-count-{run_id}@example.com",
+                            password="not a password hash")
+        db.add(user)
+        db.flush()
+        post = models.Post(user_id=user.id,
+                           caption="Query count",
+                           post_image="posts_images/query_count_full.jpg",
+                           is_ready=True)
+        db.add(post)
+        db.commit()
+        ids = (user.id, post.post_id)
+    except OperationalError:
+        db.close()
+        pytest.skip("database unreachable")
+
+    yield ids
+
+    # The post goes with its author (ON DELETE CASCADE)
+    db.execute(delete(models.Users).where(models.Users.id == ids[0]))
+    db.commit()
+    db.close()
+
+
+async def get_within_budget(path, budget, token):
+    try:
+        async with httpx.AsyncClient(
+                app=app,
+                base_url="http://test",
+                headers={"Authorization": f"Bearer {token}"}) as client:
+            with assert_max_queries(budget):
+                response = await client.get(path)
+        return response
+    finally:
+        # Pooled connections belong to this test's event loop
+        await databases.async_engine.dispose()
+
+
+@pytest.mark.parametrize("path,budget", BUDGETS)
+def test_query_budget(author, path, budget):
+    user_id, post_id = author
+    token = oauth2.create_access_token(data={"user_id": user_id})
+
+    response = asyncio.run(
+        get_within_budget(path.format(user_id=user_id, post_id=post_id),
+                          budget, token))
+
+    assert response.status_code == 200